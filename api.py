@@ -1,37 +1,213 @@
+import base64
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import datetime
+
 from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import func
+from sqlalchemy import func, case, or_, and_
 
-from models import db, Project, BudgetItem
-from pdf import apply_via_upload
+from models import db, Project, BudgetItem, Invoice, InvoiceLine, Job
+from pdf import apply_via_upload, apply_response
 from invoiceDownloader import download_and_process_invoices
+from jobs import enqueue_pdf, parse_many
+from items_import import read_rows, validate_chunk, upsert_items, import_items
+from item_search import search_items
+from payload_cache import payload_cache
+from json_provider import dumpb
+from compression import etag_variants
+from serializers import (
+    BUDGET_ITEM_COLUMNS, budget_item_detail_to_dict, project_to_dict,
+    project_summary_to_dict, portfolio_to_dict,
+)
 
 # Create API blueprint
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+log = logging.getLogger(__name__)
+
+ITEM_ERROR = "Each item requires sku, materialName, non-negative quantity, and non-negative received amount"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor pointing just past (created_at, id)."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError on garbage input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(value):
+    """Clamp the ?limit= query argument to [1, MAX_PAGE_SIZE]."""
+    if value is None or value == "":
+        return DEFAULT_PAGE_SIZE
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def is_truthy(value):
+    return (value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _project_page(stmt, cursor, limit):
+    """Apply newest-first keyset ordering on (created_at, id) to stmt."""
+    if cursor is not None:
+        created_at, project_id = cursor
+        stmt = stmt.where(
+            or_(
+                Project.created_at < created_at,
+                and_(Project.created_at == created_at, Project.id < project_id),
+            )
+        )
+    # Fetch one extra row so we know whether another page exists
+    return stmt.order_by(Project.created_at.desc(), Project.id.desc()).limit(limit + 1)
+
+
+def project_revision(project_id):
+    """Tag for the current state of a project without loading it, or None if
+    missing. It carries created_at as well as the version: SQLite hands a
+    deleted project's id to the next one, which starts again at version 1."""
+    row = db.session.execute(
+        db.select(Project.created_at, Project.version).where(Project.id == project_id)
+    ).first()
+    if row is None:
+        return None
+    return f"{project_id}.{int(row.created_at.timestamp() * 1e6):x}-v{row.version}"
+
+
+def conditional_json(etag, cache_key, build):
+    """JSON response with a strong ETag, honouring If-None-Match.
+
+    build() returns (payload, extra_headers) and only runs when the client's
+    copy is stale and the serialized body isn't in payload_cache.
+    cache_key is (kind, project_id, revision, ...).
+    """
+    if any(request.if_none_match.contains(tag) for tag in etag_variants(etag)):
+        resp = current_app.response_class(status=304)
+    else:
+        entry = payload_cache.get(cache_key)
+        if entry is None:
+            payload, headers = build()
+            body = dumpb(payload) + b"\n"
+            payload_cache.put(cache_key, body, headers)
+        else:
+            body, headers = entry
+        resp = current_app.response_class(body, mimetype="application/json")
+        resp.headers.update(headers)
+        resp.payload_cache_key = cache_key  # compression caches its body under this too
+    resp.set_etag(etag)
+    # Let browsers keep the body but always revalidate it
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @api_bp.route('/projects', methods=['GET'])
 def return_all_projects():
-    projects = Project.query.order_by(Project.created_at.desc()).all()
-    payload = []
-    for p in projects:
-        payload.append(
-            {
-                "id": p.id,
-                "name": p.name,
-                "createdAt": p.created_at.isoformat(),
-                "budgetItems": [
-                    {
-                        "id": bi.id,
-                        "sku": bi.sku,
-                        "materialName": bi.material_name,
-                        "quantity": bi.quantity,
-                        "received": bi.received,
-                        "total_payed": bi.total_payed,
-                    }
-                    for bi in p.budget_items
-                ],
-            }
+    """List projects newest first, one page at a time.
+
+    Query args:
+      limit   -- page size (default 50, max 500)
+      cursor  -- value of the X-Next-Cursor header from the previous page
+      summary -- if truthy, return per-project aggregates instead of items
+    """
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        cursor = request.args.get("cursor")
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if is_truthy(request.args.get("summary")):
+        # Pick the page of projects first so aggregation only touches its items
+        page_ids = _project_page(db.select(Project.id), cursor, limit).subquery()
+        budgeted = case((BudgetItem.quantity >= 0, BudgetItem.quantity), else_=0)
+        stmt = (
+            db.select(
+                Project.id,
+                Project.name,
+                Project.created_at,
+                Project.total_cost,
+                func.count(BudgetItem.id).label("item_count"),
+                func.coalesce(func.sum(budgeted), 0).label("quantity"),
+                func.coalesce(func.sum(BudgetItem.received), 0).label("received"),
+                func.coalesce(func.sum(BudgetItem.total_payed), 0).label("total_payed"),
+            )
+            .join(page_ids, page_ids.c.id == Project.id)
+            .outerjoin(BudgetItem, BudgetItem.project_id == Project.id)
+            .group_by(Project.id, Project.name, Project.created_at, Project.total_cost)
+            .order_by(Project.created_at.desc(), Project.id.desc())
         )
-    return jsonify(payload)
+        rows = db.session.execute(stmt).all()
+        page, more = rows[:limit], len(rows) > limit
+        payload = [project_summary_to_dict(r) for r in page]
+    else:
+        projects = db.session.execute(_project_page(db.select(Project), cursor, limit)).scalars().all()
+        page, more = projects[:limit], len(projects) > limit
+        items = defaultdict(list)
+        if page:
+            rows = db.session.execute(
+                db.select(BudgetItem.project_id, *BUDGET_ITEM_COLUMNS)
+                .where(BudgetItem.project_id.in_([p.id for p in page]))
+                .order_by(BudgetItem.id)
+            )
+            for row in rows:
+                items[row.project_id].append(row)
+        payload = [project_to_dict(p, items[p.id]) for p in page]
+
+    resp = jsonify(payload)
+    if more:
+        last = page[-1]
+        resp.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    return resp
+
+@api_bp.route('/portfolio', methods=['GET'])
+def portfolio_summary():
+    """Received-vs-budgeted rollups for every project, newest first.
+
+    Reads only the precomputed columns on projects (see rollups.py); pages
+    with the same limit/cursor arguments as /projects. ?over_budget=1 keeps
+    only projects with at least one SKU received past its budget.
+    """
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        cursor = request.args.get("cursor")
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stmt = db.select(
+        Project.id,
+        Project.name,
+        Project.created_at,
+        Project.total_cost,
+        Project.total_paid,
+        Project.total_received,
+        Project.budget_quantity,
+        Project.budget_received,
+        Project.over_budget_count,
+    )
+    if is_truthy(request.args.get("over_budget")):
+        stmt = stmt.where(Project.over_budget_count > 0)
+    rows = db.session.execute(_project_page(stmt, cursor, limit)).all()
+    page = rows[:limit]
+
+    resp = jsonify([portfolio_to_dict(r) for r in page])
+    if len(rows) > limit:
+        resp.headers["X-Next-Cursor"] = encode_cursor(page[-1].created_at, page[-1].id)
+    return resp
 
 @api_bp.route('/projects', methods=['POST'])
 def create_project():
@@ -49,71 +225,37 @@ def create_project():
     if existing is not None:
         return jsonify({"error": "A project with that name already exists"}), 409
 
-    project = Project(name=name)
-    
-    # Only process budget items if they are provided
-    if items:
-        for item in items:
-            sku = (item.get("sku") or "").strip()
-            material = (item.get("materialName") or "").strip()
-            quantity = item.get("quantity")
-            try:
-                quantity_int = int(quantity)
-            except Exception:
-                quantity_int = None
-            received_val = item.get("received", 0)
-            try:
-                received_int = int(received_val)
-            except Exception:
-                received_int = None
-            if (
-                not sku
-                or not material
-                or quantity_int is None
-                or quantity_int < 0
-                or received_int is None
-                or received_int < 0
-            ):
-                return (
-                    jsonify(
-                        {
-                            "error": "Each item requires sku, materialName, non-negative quantity, and non-negative received amount",
-                        }
-                    ),
-                    400,
-                )
-            project.budget_items.append(
-                BudgetItem(sku=sku, material_name=material, quantity=quantity_int, received=received_int)
-            )
+    valid, errors = validate_chunk(items, 1)
+    if errors:
+        return jsonify({"error": ITEM_ERROR, "errors": errors}), 400
 
+    project = Project(name=name)
     db.session.add(project)
+    db.session.flush()
+    upsert_items(project.id, valid)
     db.session.commit()
 
     return jsonify({"id": project.id}), 201
 
 @api_bp.route('/projects/<int:project_id>', methods=['GET'])
 def get_project(project_id: int):
-    project = db.session.get(Project, project_id)
-    if project is None:
+    revision = project_revision(project_id)
+    if revision is None:
         return jsonify({"error": "Not found"}), 404
-    payload = {
-        "id": project.id,
-        "name": project.name,
-        "createdAt": project.created_at.isoformat(),
-        "budgetItems": [
-            {
-                "id": bi.id,
-                "sku": bi.sku,
-                "materialName": bi.material_name,
-                "quantity": bi.quantity,
-                "received": bi.received,
-                "total_payed": bi.total_payed,
-            }
-            for bi in project.budget_items
-        ],
-        "total_cost": project.total_cost
-    }
-    return jsonify(payload)
+
+    def build():
+        project = db.session.get(Project, project_id)
+        # Plain rows: building thousands of BudgetItem objects costs more than the JSON
+        items = db.session.execute(
+            db.select(*BUDGET_ITEM_COLUMNS)
+            .where(BudgetItem.project_id == project_id)
+            .order_by(BudgetItem.id)
+        ).all()
+        payload = project_to_dict(project, items)
+        payload["total_cost"] = project.total_cost
+        return payload, {}
+
+    return conditional_json(f"p{revision}", ("project", project_id, revision), build)
 
 @api_bp.route('/projects/<int:project_id>', methods=['DELETE'])
 def delete_project(project_id: int):
@@ -124,6 +266,7 @@ def delete_project(project_id: int):
 
     db.session.delete(project)
     db.session.commit()
+    payload_cache.discard(lambda key: key[1] == project_id)
     return ("", 204)
 
 @api_bp.route('/projects/<int:project_id>', methods=['PUT'])
@@ -152,47 +295,86 @@ def update_project(project_id: int):
     if items is not None:
         if not isinstance(items, list):
             return jsonify({"error": "budgetItems must be a list"}), 400
-        # Replace all budget items
-
-        
-        for item in items:
-            sku = (item.get("sku") or "").strip()
-            print(item)
-            material = (item.get("materialName") or "").strip()
-            quantity = item.get("quantity")
-            try:
-                quantity_int = int(quantity)
-            except Exception:
-                quantity_int = None
-            received_val = item.get("received", 0)
-            try:
-                received_int = int(received_val)
-            except Exception:
-                received_int = None
-            total_payed = (item.get("total_payed"))
-            if (
-                not sku
-                or not material
-                or quantity_int is None
-                or quantity_int < 0
-                or received_int is None
-                or received_int < 0
-            ):
-                return (
-                    jsonify(
-                        {
-                            "error": "Each item requires sku, materialName, non-negative quantity, and non-negative received amount",
-                        }
-                    ),
-                    400,
-                )
-            for budget_item in project.budget_items:
-                if budget_item.sku == sku:
-                    budget_item.overwrite(sku, material, quantity_int, received_int, total_payed)
-                    
+        valid, errors = validate_chunk(items, 1)
+        if errors:
+            return jsonify({"error": ITEM_ERROR, "errors": errors}), 400
+        # Overwrite items whose SKU already exists and add the rest
+        upsert_items(project.id, valid)
+
     db.session.commit()
     return ("", 204)
 
+@api_bp.route('/projects/<int:project_id>/items', methods=['GET'])
+def search_budget_items(project_id: int):
+    """Search a project's budget items, filtered, sorted and paginated in SQL.
+
+    Query arguments (all optional):
+      sku       -- SKU prefix (case-sensitive)
+      q         -- substring of the material name
+      shortfall -- only items with received < quantity
+      location  -- exact location; empty for items without one
+      sort      -- sku (default), material, quantity, received, shortfall,
+                   total_payed, location, um or price_per
+      order     -- asc (default) or desc
+      limit, cursor -- paging as for /invoices, cursor from X-Next-Cursor
+    """
+    args = request.args
+    try:
+        limit = parse_limit(args.get("limit"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    revision = project_revision(project_id)
+    if revision is None:
+        return jsonify({"error": "Not found"}), 404
+
+    def build():
+        items, next_cursor = search_items(
+            project_id,
+            sku_prefix=args.get("sku", ""),
+            material=args.get("q", "").strip(),
+            shortfall=is_truthy(args.get("shortfall")),
+            location=args.get("location"),
+            sort=args.get("sort", "sku"),
+            descending=args.get("order", "asc").lower() == "desc",
+            limit=limit,
+            cursor=args.get("cursor") or None,
+        )
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return [budget_item_detail_to_dict(item) for item in items], headers
+
+    query_key = hashlib.sha1(request.query_string).hexdigest()[:12]
+    try:
+        return conditional_json(
+            f"s{revision}-{query_key}",
+            ("items", project_id, revision, request.query_string),
+            build,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@api_bp.route('/projects/<int:project_id>/items/import', methods=['POST'])
+def import_budget_items(project_id: int):
+    """Upsert budget items by SKU from a CSV, NDJSON or JSON body or file.
+
+    The format comes from the Content-Type header, or from the extension of
+    an uploaded 'file'. Invalid rows are reported and skipped.
+    """
+    if db.session.get(Project, project_id) is None:
+        return jsonify({"error": "Not found"}), 404
+
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, content_type, filename = upload.stream, upload.mimetype, upload.filename
+    else:
+        stream, content_type, filename = request.stream, request.mimetype, ""
+
+    try:
+        summary = import_items(project_id, read_rows(stream, content_type, filename))
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Could not read items: {e}"}), 400
+    return jsonify(summary)
+
 @api_bp.route('/projects/<int:project_id>/apply-pdf', methods=['POST'])
 def apply_pdf_to_project_route(project_id: int):
     project = db.session.get(Project, project_id)
@@ -205,14 +387,76 @@ def apply_pdf_to_project_route(project_id: int):
     if not file or file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
+    if is_truthy(request.args.get("async")):
+        job = enqueue_pdf(current_app._get_current_object(), project, file.read(), file.filename)
+        resp = jsonify({"jobId": job.id, "status": job.status})
+        resp.headers["Location"] = f"/api/jobs/{job.id}"
+        return resp, 202
+
     try:
         result = apply_via_upload(file, project)
         if result["invoice_used"]:
-            print("BAD BOY")
+            log.info("Duplicate invoice %s uploaded to project %s", result["invoice_number"], project_id)
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@api_bp.route('/projects/<int:project_id>/apply-pdfs', methods=['POST'])
+def apply_pdfs_to_project_route(project_id: int):
+    """Apply many uploaded PDFs (form field 'files') in one transaction.
+
+    Files are parsed in parallel, then applied in upload order, each inside
+    its own savepoint so one bad file doesn't undo the others. Returns a
+    result per file.
+    """
+    project = db.session.get(Project, project_id)
+    if project is None:
+        return jsonify({"error": "Not found"}), 404
+
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+
+    parsed = parse_many([f.read() for f in files])
+
+    results = []
+    for file, response in zip(files, parsed):
+        result = {"filename": file.filename}
+        if isinstance(response, Exception):
+            result.update(status="error", error=str(response))
+            results.append(result)
+            continue
+        result.update(
+            invoice_number=response["invoice_number"],
+            items=len(response["items"]),
+            skipped_lines=response["skipped_lines"],
+        )
+        try:
+            with db.session.begin_nested():
+                apply_response(project, response)
+        except Exception as e:
+            # The savepoint rolled back this file's changes
+            result.update(status="error", error=str(e))
+        else:
+            result.update(
+                status="duplicate" if response["invoice_used"] else "applied",
+                error=response["error"],
+            )
+        results.append(result)
+    db.session.commit()
+
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("applied", "duplicate", "error")}
+    return jsonify({"results": results, **counts})
+
+@api_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id: int):
+    """Status, progress and (once done) result of a background job."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(job.to_dict())
+
 @api_bp.route('/process-invoices', methods=['POST'])
 def process_invoices_from_email():
     """Manually trigger the invoice downloader to process emails."""
@@ -233,14 +477,52 @@ def process_invoices_from_email():
 
 @api_bp.route('/invoices/<int:project_id>', methods=['GET'])
 def get_invoices_by_project(project_id):
+    """Applied invoices for a project, oldest first, paginated like /projects."""
     try:
-        project = db.session.get(Project, project_id)
-        if project is None:
+        limit = parse_limit(request.args.get("limit"))
+        raw_cursor = request.args.get("cursor") or ""
+        cursor = decode_cursor(raw_cursor) if raw_cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        revision = project_revision(project_id)
+        if revision is None:
             return jsonify({"error": "Not found"}), 404
-        
-        # Get the used invoices from the project
-        invoices = project.get_used_invoice()
-        return jsonify(invoices)
+
+        def build():
+            stmt = db.select(Invoice).where(Invoice.project_id == project_id)
+            if cursor is not None:
+                created_at, invoice_id = cursor
+                stmt = stmt.where(
+                    or_(
+                        Invoice.created_at > created_at,
+                        and_(Invoice.created_at == created_at, Invoice.id > invoice_id),
+                    )
+                )
+            stmt = stmt.order_by(Invoice.created_at, Invoice.id).limit(limit + 1)
+            invoices = db.session.execute(stmt).scalars().all()
+            page = invoices[:limit]
+
+            headers = {}
+            if len(invoices) > limit:
+                headers["X-Next-Cursor"] = encode_cursor(page[-1].created_at, page[-1].id)
+            lines = defaultdict(list)
+            if page:
+                rows = db.session.execute(
+                    db.select(InvoiceLine.invoice_id, *(getattr(InvoiceLine, f) for f in InvoiceLine.FIELDS))
+                    .where(InvoiceLine.invoice_id.in_([invoice.id for invoice in page]))
+                    .order_by(InvoiceLine.invoice_id, InvoiceLine.position)
+                )
+                for row in rows:
+                    lines[row.invoice_id].append(row)
+            return [invoice.to_dict(lines[invoice.id]) for invoice in page], headers
+
+        page_key = hashlib.sha1(f"{limit}|{raw_cursor}".encode()).hexdigest()[:12]
+        return conditional_json(
+            f"i{revision}-{page_key}",
+            ("invoices", project_id, revision, limit, raw_cursor),
+            build,
+        )
     except Exception as e:
         return jsonify({"error": f"Failed to fetch invoices: {str(e)}"}), 500
-    
\ No newline at end of file
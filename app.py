@@ -1,47 +1,64 @@
+import logging
 import os
 from flask import Flask
-from sqlalchemy import text
 
 # Load environment variables from .env file (optional)
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except ImportError:
-    print("python-dotenv not installed, using system environment variables")
+    load_dotenv = None
+
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+if load_dotenv is None:
+    logging.getLogger(__name__).info("python-dotenv not installed, using system environment variables")
 
 from routes import register_routes
 from api import api_bp
+from export import export_bp
 from models import db
+import migrations
+import engine_config
+from rollups import register_commands
+import metrics
+import mail_poller
+import jobs
+import json_provider
+import compression
 
 
-app = Flask(__name__, static_folder='static')
-
-register_routes(app)
-app.register_blueprint(api_bp)
-
-# Database configuration for production
-if os.environ.get('DATABASE_URL'):
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get('DATABASE_URL')
-else:
-    db_path = os.path.join(os.path.dirname(__file__), "database.db")
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+def create_app(database_url=None):
+    """Build the Flask app. Nothing here touches the database; the schema is
+    brought up to date by `flask --app app migrate` (the release step in the
+    Procfile) before workers start."""
+    app = Flask(__name__, static_folder='static')
+    json_provider.init_app(app)
 
-db.init_app(app)
+    register_routes(app)
+    register_commands(app)
+    migrations.register_commands(app)
+    metrics.init_app(app)
+    compression.init_app(app)  # registered after metrics so its time is counted
+    mail_poller.init_app(app)
+    jobs.init_app(app)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(export_bp)
 
-with app.app_context():
-    db.create_all()
+    # Database configuration: DATABASE_URL in production, a local SQLite file otherwise
+    engine_config.configure(app, os.path.join(os.path.dirname(__file__), "database.db"), database_url)
 
-    try:
-        cols = db.session.execute(text("PRAGMA table_info('budget_items')")).all()
-        has_sku = any((c[1] == "sku") for c in cols)
-        if not has_sku:
-            db.session.execute(text("ALTER TABLE budget_items ADD COLUMN sku VARCHAR(50) NOT NULL DEFAULT ''"))
-            db.session.commit()
-    except Exception:
-        pass
+    db.init_app(app)
+    return app
 
 
 if __name__ == "__main__":
+    app = create_app()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
-    app.run(host="0.0.0.0", port=port, debug=debug)
\ No newline at end of file
+    # The dev server migrates for convenience; deployments use the release step
+    with app.app_context():
+        migrations.migrate()
+    app.run(host="0.0.0.0", port=port, debug=debug)
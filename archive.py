@@ -0,0 +1,40 @@
+"""Optional content-addressed archive of original invoice PDFs.
+
+Set INVOICE_ARCHIVE_DIR to keep a copy of every PDF that gets ingested. Files
+are named by the SHA-256 of their bytes (``<dir>/ab/abcdef....pdf``), so the
+same invoice received twice is stored once. Without the variable nothing is
+written to disk.
+"""
+import hashlib
+import os
+import tempfile
+
+
+def archive_dir():
+    return os.environ.get("INVOICE_ARCHIVE_DIR", "")
+
+
+def archive_pdf(data, digest=None):
+    """Store data in the archive if enabled. Returns its path, or None.
+
+    Pass digest when the SHA-256 of data is already known to skip rehashing.
+    """
+    root = archive_dir()
+    if not root:
+        return None
+    digest = digest or hashlib.sha256(data).hexdigest()
+    folder = os.path.join(root, digest[:2])
+    path = os.path.join(folder, digest + ".pdf")
+    if os.path.exists(path):
+        return path
+    os.makedirs(folder, exist_ok=True)
+    # Write then rename so concurrent writers never leave a partial file behind
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
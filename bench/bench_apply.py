@@ -0,0 +1,76 @@
+"""Applying a 500-line invoice to a 5,000-item project.
+
+Times apply_pdf_to_project, the path uploads, emails and jobs share, over
+several invoices (90% of lines hit existing items, the rest are new SKUs),
+and breaks one apply into its statements: the invoice insert, the
+received/total_payed upsert in add_received and the rollup update. Checks
+that every line's quantity landed on its item.
+"""
+import random
+import statistics
+import time
+
+from bench.fixtures import parsed_invoice
+from bench.util import QueryCounter, make_app, timed
+
+PROJECT_ITEMS = 5000
+INVOICE_LINES = 500
+INVOICES = 10
+
+
+def invoice_skus(rng, number):
+    skus = rng.sample([f"SKU{n:05d}" for n in range(PROJECT_ITEMS)], INVOICE_LINES * 9 // 10)
+    return skus + [f"NEW{number}-{n:04d}" for n in range(INVOICE_LINES - len(skus))]
+
+
+def main():
+    app = make_app()
+    from models import db, Project, BudgetItem
+    from pdf import add_received, apply_pdf_to_project, insert_invoice
+    from rollups import apply as apply_rollups
+
+    rng = random.Random(1)
+    with app.app_context():
+        project = Project(name="Bench Lot")
+        db.session.add(project)
+        db.session.flush()
+        db.session.execute(
+            db.insert(BudgetItem),
+            [
+                {"project_id": project.id, "sku": f"SKU{n:05d}", "material_name": f"item {n}",
+                 "quantity": 100, "received": 0, "total_payed": 0, "extra_data": {}}
+                for n in range(PROJECT_ITEMS)
+            ],
+        )
+        db.session.commit()
+
+        samples, expected = [], {}
+        for number in range(INVOICES):
+            response = parsed_invoice(1000 + number, invoice_skus(rng, number))
+            for item in response["items"]:
+                expected[item["sku"]] = expected.get(item["sku"], 0) + int(item["shipped"])
+            with QueryCounter(db.engine) as queries:
+                start = time.perf_counter()
+                apply_pdf_to_project(project, response)
+                samples.append(time.perf_counter() - start)
+        print(f"{'apply_pdf_to_project (500 lines)':<40} {statistics.median(samples) * 1000:10.2f} ms "
+              f"median of {INVOICES}, {queries.count} statements")
+
+        # One more, step by step, rolled back afterwards
+        response = parsed_invoice(2000, invoice_skus(rng, INVOICES))
+        with timed("  insert_invoice"):
+            insert_invoice(project.id, response)
+        with timed("  add_received upsert"):
+            deltas = add_received(project.id, response["items"])
+        with timed("  rollups.apply"):
+            apply_rollups(deltas)
+        db.session.rollback()
+
+        received = dict(db.session.execute(
+            db.select(BudgetItem.sku, BudgetItem.received).where(BudgetItem.project_id == project.id)
+        ).all())
+        assert all(received[sku] == count for sku, count in expected.items())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Email ingestion of a 100 invoice backlog from a fake IMAP mailbox.
+
+Compares parsing and applying one attachment at a time (the old behaviour)
+with the fetch -> process pool -> single writer pipeline.
+"""
+from bench.fake_imap import FakeMailbox
+from bench.fixtures import invoice_pdf
+from bench.util import make_app, timed
+
+INVOICES = 100
+LINES_PER_INVOICE = 40
+LATENCY = 0.02  # seconds per message fetch
+
+
+def build_mailbox(offset):
+    mail = FakeMailbox(latency=LATENCY)
+    for n in range(INVOICES):
+        address = ("LOT", str(n % 10), "MAPLE")
+        skus = [f"SKU{n % 7}{k:03d}" for k in range(LINES_PER_INVOICE)]
+        data, _ = invoice_pdf(offset + n, skus, address_words=address)
+        mail.add_invoice(f"invoice-{offset + n}.pdf", data)
+    return mail
+
+
+def sequential(app, mail):
+    from pdf import apply_pdf_via_email
+    import invoiceDownloader
+
+    count = 0
+    with app.app_context():
+        for (uid, attachments) in invoiceDownloader.fetch_attachments(mail):
+            for (_, _, data) in attachments:
+                apply_pdf_via_email(data)
+                count += 1
+            mail.mark_seen(uid)
+    return count
+
+
+def main():
+    app = make_app()
+    from invoiceDownloader import download_and_process_invoices
+    from jobs import parse_pool
+
+    parse_pool().submit(int).result()  # start the worker processes up front
+
+    mail = build_mailbox(10000)
+    with timed(f"sequential, {INVOICES} invoices"):
+        count = sequential(app, mail)
+    assert count == INVOICES
+
+    mail = build_mailbox(20000)
+    with timed(f"pipeline, {INVOICES} invoices"):
+        _, count = download_and_process_invoices(app, mail)
+    assert count == INVOICES, count
+    assert len(mail.seen) == INVOICES
+
+
+if __name__ == "__main__":
+    main()
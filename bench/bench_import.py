@@ -0,0 +1,57 @@
+"""Throughput of POST /api/projects/<id>/items/import on SQLite.
+
+Imports 100k CSV rows into an empty project (all inserts), imports them
+again (all updates), then sends the same rows as NDJSON with 1% invalid rows.
+"""
+import io
+import json
+import time
+
+from bench.util import make_app
+
+ROWS = 100_000
+
+
+def csv_body(rows, bad_every=0):
+    out = io.StringIO()
+    out.write("sku,materialName,quantity\n")
+    for n in range(rows):
+        quantity = "lots" if bad_every and n % bad_every == 0 else str(n % 500)
+        out.write(f"SKU{n:06d},2x4 stud {n},{quantity}\n")
+    return out.getvalue().encode()
+
+
+def ndjson_body(rows, bad_every=0):
+    lines = []
+    for n in range(rows):
+        row = {"sku": f"SKU{n:06d}", "materialName": f"2x4 stud {n}", "quantity": n % 500, "received": n % 7}
+        if bad_every and n % bad_every == 0:
+            row["quantity"] = -1
+        lines.append(json.dumps(row))
+    return "\n".join(lines).encode()
+
+
+def run(client, project_id, label, body, content_type):
+    start = time.perf_counter()
+    resp = client.post(f"/api/projects/{project_id}/items/import", data=body, content_type=content_type)
+    elapsed = time.perf_counter() - start
+    summary = resp.get_json()
+    assert resp.status_code == 200, summary
+    print(f"{label:<28} {elapsed:7.2f} s {summary['rows'] / elapsed:10.0f} rows/s "
+          f"upserted {summary['upserted']}, errors {summary['errorCount']}")
+    return summary
+
+
+def main():
+    app = make_app()
+    client = app.test_client()
+    project_id = client.post("/api/projects", json={"name": "Takeoff"}).get_json()["id"]
+
+    run(client, project_id, "CSV insert 100k", csv_body(ROWS), "text/csv")
+    run(client, project_id, "CSV update 100k", csv_body(ROWS), "text/csv")
+    summary = run(client, project_id, "NDJSON upsert, 1% invalid", ndjson_body(ROWS, 100), "application/x-ndjson")
+    assert summary["errorCount"] == ROWS // 100
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Load test of the JSON API and the ingestion endpoints.
+
+Seeds a throwaway SQLite database with synthetic projects and budget items,
+serves the app from a threaded werkzeug server and drives it over HTTP with
+concurrent clients. For each scenario it reports p50/p95/p99 latency,
+throughput, errors and SQL statements per request, and writes everything to
+a JSON file. Pass --baseline with an earlier results file to compare; the
+run exits non-zero if any scenario's p95 got worse by more than --tolerance.
+
+    python -m bench.bench_load --out results.json
+    python -m bench.bench_load --baseline results.json
+
+Scenarios:
+  list              GET  /api/projects (first page)
+  detail            GET  /api/projects/<id>
+  update            PUT  /api/projects/<id> with a few items
+  apply-pdf         POST /api/projects/<id>/apply-pdf with a generated invoice PDF
+  process-invoices  POST /api/process-invoices against an in-memory mailbox
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bench.fake_imap import FakeMailbox
+from bench.fixtures import invoice_pdf
+from bench.util import make_app, QueryCounter
+
+LOCATIONS = ("YARD", "BAY1", "BAY2", "BAY3", "SHED")
+
+
+def seed(db, Project, BudgetItem, projects, items_per_project):
+    """Insert projects named Lot <n> whose items use SKUs SKU<n>-<k>."""
+    from rollups import recompute_all
+
+    base = datetime(2024, 1, 1)
+    db.session.execute(db.insert(Project), [
+        {"name": f"Lot {i}", "created_at": base + timedelta(minutes=i), "used_invoices": [], "total_cost": 0}
+        for i in range(projects)
+    ])
+    ids = db.session.execute(db.select(Project.id).order_by(Project.id)).scalars().all()
+    rows = []
+    for n, pid in enumerate(ids):
+        for k in range(items_per_project):
+            rows.append({
+                "project_id": pid,
+                "sku": f"SKU{n}-{k}",
+                "material_name": f"2X{k % 12 + 2} SPF STUD {k}",
+                "quantity": random.randint(10, 200),
+                "received": random.randint(0, 150),
+                "total_payed": 0,
+                "extra_data": {},
+                "location": random.choice(LOCATIONS),
+            })
+    db.session.execute(db.insert(BudgetItem), rows)
+    db.session.commit()
+    recompute_all()
+    return ids
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.failures = []  # the first few error responses, for the report
+
+    def call(self, method, path, body=None, content_type=None):
+        """Returns (status, seconds)."""
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+            if len(self.failures) < 5:
+                self.failures.append(f"{method} {path}: {status} {body[:200]!r}")
+        return status, time.perf_counter() - start
+
+
+def run_scenario(name, make_request, requests, clients, engine):
+    """Issue requests calls of make_request(i) from clients threads."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        status, seconds = make_request(i)
+        with lock:
+            latencies.append(seconds)
+            if status >= 400:
+                errors += 1
+
+    with QueryCounter(engine) as qc:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "requests": requests,
+        "clients": clients,
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "queries_per_request": round(qc.count / requests, 2),
+    }
+    print(f"{name:<17} {result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f} "
+          f"{result['throughput_rps']:9.1f} {result['queries_per_request']:8.1f} {errors:6d}")
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Print p95/throughput changes against baseline. Returns the regressed scenarios."""
+    regressed = []
+    print(f"\n{'vs baseline':<17} {'p95':>9} {'rps':>9}")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        p95 = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0
+        rps = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0
+        flag = "  REGRESSION" if p95 > tolerance else ""
+        print(f"{name:<17} {p95:+8.0%} {rps:+8.0%}{flag}")
+        if flag:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--items", type=int, default=50, help="budget items per project")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400, help="requests per read/update scenario")
+    parser.add_argument("--pdfs", type=int, default=60, help="apply-pdf requests")
+    parser.add_argument("--mail-runs", type=int, default=10, help="process-invoices requests")
+    parser.add_argument("--mail-invoices", type=int, default=5, help="invoices in the mailbox per run")
+    parser.add_argument("--lines", type=int, default=30, help="lines per generated invoice")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench-load-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("SLOW_REQUEST_MS", "60000")
+    app = make_app()
+    from werkzeug.serving import make_server
+    from models import db, Project, BudgetItem
+    import invoiceDownloader
+
+    with app.app_context():
+        ids = seed(db, Project, BudgetItem, args.projects, args.items)
+        engine = db.engine
+
+    # Invoice PDFs against existing SKUs, generated before the clock starts
+    invoice_numbers = itertools.count(100000)
+    pdfs = []
+    for _ in range(args.pdfs):
+        n = random.randrange(len(ids))
+        skus = [f"SKU{n}-{k}" for k in random.sample(range(args.items), min(args.lines, args.items))]
+        data, _ = invoice_pdf(next(invoice_numbers), skus)
+        pdfs.append((ids[n], data))
+    mailboxes = []
+    for _ in range(args.mail_runs):
+        mail = FakeMailbox()
+        for _ in range(args.mail_invoices):
+            n = random.randrange(len(ids))
+            skus = [f"SKU{n}-{k}" for k in random.sample(range(args.items), min(args.lines, args.items))]
+            number = next(invoice_numbers)
+            data, _ = invoice_pdf(number, skus, address_words=("LOT", str(n)))
+            mail.add_invoice(f"invoice-{number}.pdf", data)
+        mailboxes.append(mail)
+    mail_queue = iter(mailboxes)
+    mail_lock = threading.Lock()
+
+    def next_mailbox():
+        with mail_lock:
+            return next(mail_queue)
+
+    # The IMAP server is stubbed: each run reads its own in-memory mailbox
+    invoiceDownloader.open_mailbox = next_mailbox
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request access log
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Client(f"http://127.0.0.1:{server.server_port}")
+
+    def update(i):
+        pid = random.choice(ids)
+        n = ids.index(pid)
+        body = json.dumps({"budgetItems": [
+            {"sku": f"SKU{n}-{k}", "materialName": f"2X4 SPF STUD {k}", "quantity": random.randint(10, 200)}
+            for k in random.sample(range(args.items), min(5, args.items))
+        ]}).encode()
+        return client.call("PUT", f"/api/projects/{pid}", body, "application/json")
+
+    def apply_pdf(i):
+        pid, data = pdfs[i]
+        body, content_type = multipart("file", f"invoice-{i}.pdf", data)
+        return client.call("POST", f"/api/projects/{pid}/apply-pdf", body, content_type)
+
+    scenarios = (
+        ("list", lambda i: client.call("GET", "/api/projects?limit=50"), args.requests, args.clients),
+        ("detail", lambda i: client.call("GET", f"/api/projects/{random.choice(ids)}"), args.requests, args.clients),
+        ("update", update, args.requests, args.clients),
+        ("apply-pdf", apply_pdf, args.pdfs, args.clients),
+        ("process-invoices", lambda i: client.call("POST", "/api/process-invoices"),
+         args.mail_runs, min(args.clients, 2)),
+    )
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+            "params": vars(args),
+        },
+        "scenarios": {},
+    }
+    print(f"{'scenario':<17} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8} {'errors':>6}")
+    try:
+        for name, make_request, requests, clients in scenarios:
+            results["scenarios"][name] = run_scenario(name, make_request, requests, clients, engine)
+    finally:
+        server.shutdown()
+    for failure in client.failures:
+        print("error:", failure)
+    results["errors"] = client.failures
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Invoice parser micro-benchmarks.
+
+1. Text only: the original parse_pdf loop (one big string, substring checks
+   and re.sub with patterns recompiled per call) against pdf.parse_lines over
+   the same synthetic invoice text.
+2. Full PDF: parse_pdf over a 30 page invoice with repeated letterheads and
+   trailing terms pages, reading every page vs table_only mode.
+"""
+import re
+import tracemalloc
+
+from bench.fixtures import invoice_text_lines, multipage_invoice_pdf, parsed_invoice
+from bench.util import timed
+
+LINES = 1500
+REPEAT = 20
+
+
+def legacy_parse_text(text):
+    """parse_pdf's line loop as it was before pages were streamed, error
+    messages included."""
+    parsing_items = False
+    DaysOW = {"MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"}
+    response = {"items": [], "skipped_lines": [], "invoice_number": 0, "invoice_used": False,
+                "total_price": 0, "error": "", "adress": ""}
+    expect_adress = False
+    for line in text.splitlines():
+        if parsing_items and line.upper().strip() in DaysOW:
+            parsing_items = False
+        elif "INVOICE:" in line:
+            response["invoice_number"] = re.sub(r'\D', '', line)
+        elif "TOTAL" in line:
+            match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+\.\d{2})', line.replace(',', ''))
+            response['total_price'] = match.group(1) if match else ""
+        elif "SHIP TO:" in line:
+            expect_adress = True
+        elif expect_adress:
+            capture = False
+            for word in line.split():
+                if word == "DEL.":
+                    expect_adress = False
+                    break
+                if capture:
+                    response["adress"] += word
+                if word == "LLC":
+                    capture = True
+        if parsing_items:
+            split_line = line.split()
+            if len(split_line) < 14:
+                response["skipped_lines"].append(split_line[0] if split_line else "")
+                response["error"] += ("Lines were skipped due to failure in pdf parsing please email the pdf to jaykit19@gmail.com \n")
+                continue
+            data = {
+                'line': re.sub(r'\D', '', split_line[0]),
+                'shipped': re.sub(r'\D', '', split_line[1]),
+                'ordered': re.sub(r'\D', '', split_line[2]),
+                'unit_measurement': split_line[3],
+                'sku': split_line[4],
+                'description': " ".join(split_line[5:9]),
+                'location': split_line[9],
+                'units': split_line[10],
+                'price_per': re.sub(r'\D', '', split_line[11]),
+                'extension': split_line[13],
+            }
+            response["items"].append(data)
+            if data['shipped'] != data['ordered']:
+                response['error'] += ('LESS ITEMS SHIPPED THAN ORDERED PLEASE EMAIL JAYKITT19@GMAIL.COM \n')
+        if "EXTENSION" in line:
+            parsing_items = True
+    return response
+
+
+def main():
+    from pdf import parse_lines, parse_pdf
+
+    response = parsed_invoice(1, [f"SKU{n}" for n in range(LINES)])
+    lines = invoice_text_lines(response, ("12", "MAPLE", "ST"))
+    pages = [lines[i:i + 50] for i in range(0, len(lines), 50)]
+
+    with timed(f"legacy text loop x{REPEAT} ({LINES} lines)"):
+        for _ in range(REPEAT):
+            text = ""
+            for page in pages:
+                text += "\n".join(page) + "\n"
+            legacy = legacy_parse_text(text)
+    with timed(f"parse_lines x{REPEAT} ({LINES} lines)"):
+        for _ in range(REPEAT):
+            streamed = parse_lines(line for page in pages for line in page)
+    assert legacy["items"] == streamed["items"]
+    assert legacy["error"] == streamed["error"]
+
+    data, expected = multipage_invoice_pdf(2, [f"SKU{n}" for n in range(1350)], terms_pages=3)
+    for table_only in (False, True):
+        tracemalloc.start()
+        with timed(f"parse_pdf 30 pages, table_only={table_only}"):
+            result = parse_pdf(data, table_only=table_only)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'':<40} peak {peak / 1e6:8.1f} MB, items {len(result['items'])}, "
+              f"skipped {len(result['skipped_lines'])}")
+    assert result["items"] == expected["items"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Response time and size of the large JSON payloads.
+
+Seeds one project with 5,000 budget items and 200 applied invoices, then
+times the endpoints that return them through the test client: the project
+detail with the payload cache cleared before every request (the first read
+after a change), the first page of /projects and a 500-invoice page of
+/invoices. Each runs once per Accept-Encoding and reports the median time
+and the size of the body that would go over the wire.
+
+    python -m bench.bench_payload [runs]
+
+Also times json.dumps against the app's JSON provider on the same payload.
+"""
+import json
+import statistics
+import sys
+import time
+
+from bench.fixtures import parsed_invoice
+from bench.util import make_app
+
+PROJECT_ITEMS = 5000
+INVOICES = 200
+INVOICE_LINES = 20
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def seed(db, Project, BudgetItem):
+    from pdf import apply_response
+
+    project = Project(name="Payload Lot")
+    db.session.add(project)
+    db.session.flush()
+    db.session.execute(db.insert(BudgetItem), [
+        {"project_id": project.id, "sku": f"SKU{n:05d}", "material_name": f"2X4 SPF STUD {n}",
+         "quantity": 100, "received": n % 120, "total_payed": round(n * 1.37, 2), "extra_data": {}}
+        for n in range(PROJECT_ITEMS)
+    ])
+    for number in range(INVOICES):
+        skus = [f"SKU{(number * INVOICE_LINES + k) % PROJECT_ITEMS:05d}" for k in range(INVOICE_LINES)]
+        apply_response(project, parsed_invoice(700000 + number, skus))
+    db.session.commit()
+    return project.id
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    app = make_app()
+    from models import db, Project, BudgetItem
+    from payload_cache import payload_cache
+
+    with app.app_context():
+        pid = seed(db, Project, BudgetItem)
+    client = app.test_client()
+
+    endpoints = (
+        ("project detail (cold)", f"/api/projects/{pid}", True),
+        ("project detail (cached)", f"/api/projects/{pid}", False),
+        ("projects list", "/api/projects?limit=1", False),
+        ("invoices page", f"/api/invoices/{pid}?limit=500", True),
+    )
+    print(f"{'endpoint':<24} {'encoding':<9} {'median ms':>10} {'bytes':>10}  content-encoding")
+    for label, path, cold in endpoints:
+        for encoding in ENCODINGS:
+            headers = {"Accept-Encoding": encoding}
+
+            def get():
+                if cold:
+                    payload_cache.clear()
+                return client.get(path, headers=headers)
+
+            resp = get()
+            assert resp.status_code == 200, resp.status_code
+            ms = median_ms(get, runs)
+            print(f"{label:<24} {encoding:<9} {ms:10.2f} {len(resp.data):10d}  "
+                  f"{resp.headers.get('Content-Encoding', '-')}")
+
+    with app.app_context():
+        payload = client.get(f"/api/projects/{pid}").get_json()
+        dumps_ms = median_ms(lambda: json.dumps(payload), runs)
+        provider_ms = median_ms(lambda: app.json.dumps(payload), runs)
+    print(f"\nserialize 5,000-item project: json.dumps {dumps_ms:.2f} ms, "
+          f"{type(app.json).__name__} {provider_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Query count and latency of GET /api/projects as the project count grows.
+
+The listing must issue a constant number of SQL statements per page no matter
+how many projects (or items per project) exist.
+"""
+import random
+from datetime import datetime, timedelta
+
+from bench.util import make_app, QueryCounter, timed
+
+ITEMS_PER_PROJECT = 20
+SIZES = (10, 100, 1000, 5000)
+
+
+def seed(db, Project, BudgetItem, start, count):
+    base = datetime(2024, 1, 1)
+    projects = [
+        {"name": f"Lot {i}", "created_at": base + timedelta(minutes=i), "used_invoices": [], "total_cost": 0}
+        for i in range(start, start + count)
+    ]
+    db.session.execute(db.insert(Project), projects)
+    ids = db.session.execute(db.select(Project.id).where(Project.name.in_([p["name"] for p in projects]))).scalars()
+    items = []
+    for pid in ids:
+        for n in range(ITEMS_PER_PROJECT):
+            items.append(
+                {
+                    "project_id": pid,
+                    "sku": f"SKU{n}",
+                    "material_name": f"2x{n}",
+                    "quantity": random.randint(0, 100),
+                    "received": random.randint(0, 100),
+                    "total_payed": 0,
+                    "extra_data": {},
+                }
+            )
+    db.session.execute(db.insert(BudgetItem), items)
+    db.session.commit()
+
+
+def main():
+    app = make_app()
+    from models import db, Project, BudgetItem
+
+    client = app.test_client()
+    seeded = 0
+    print(f"{'projects':>8} {'mode':>8} {'queries':>8}")
+    with app.app_context():
+        for size in SIZES:
+            seed(db, Project, BudgetItem, seeded, size - seeded)
+            seeded = size
+            db.session.remove()
+            for mode, qs in (("items", ""), ("summary", "?summary=1")):
+                with QueryCounter(db.engine) as qc:
+                    with timed(f"{size} projects, {mode}"):
+                        resp = client.get("/api/projects" + qs)
+                assert resp.status_code == 200
+                print(f"{size:>8} {mode:>8} {qc.count:>8}")
+
+
+if __name__ == "__main__":
+    main()
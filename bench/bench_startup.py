@@ -0,0 +1,60 @@
+"""Cold start cost of a web worker: import time and resident memory.
+
+Each scenario runs in a fresh interpreter that imports the app and calls
+create_app(), the work gunicorn does per worker. "eager" also imports
+pdfplumber and imbox up front, which is what every worker paid before those
+imports were made lazy; "lazy" is the current behaviour of a worker that
+only serves JSON reads.
+
+    python -m bench.bench_startup [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+CHILD = r"""
+import json, resource, sys, time
+start = time.perf_counter()
+if {eager}:
+    import pdfplumber, imbox
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "pdfplumber_loaded": "pdfplumber" in sys.modules,
+    "imbox_loaded": "imbox" in sys.modules,
+}}))
+"""
+
+
+def run(eager, env):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD.format(eager=eager)],
+        capture_output=True, text=True, check=True, env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ)
+    env["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="catalyst-bench-"), "bench.db")
+    env["LOG_LEVEL"] = "WARNING"
+    run(False, env)  # warm the filesystem and bytecode caches
+
+    print(f"{'scenario':<10} {'import+create_app':>18} {'max RSS':>10}  heavy modules loaded")
+    for label, eager in (("eager", True), ("lazy", False)):
+        samples = [run(eager, env) for _ in range(runs)]
+        seconds = sorted(s["seconds"] for s in samples)[len(samples) // 2]
+        rss = sorted(s["max_rss_kb"] for s in samples)[len(samples) // 2]
+        loaded = [name for name in ("pdfplumber", "imbox") if samples[0][f"{name}_loaded"]]
+        print(f"{label:<10} {seconds * 1000:15.1f} ms {rss / 1024:7.1f} MB  {', '.join(loaded) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
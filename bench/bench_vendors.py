@@ -0,0 +1,195 @@
+"""Layout dispatch over a mixed-vendor invoice corpus.
+
+Registers two synthetic supplier layouts (plus FILLER_LAYOUTS that never
+match, standing in for a long registry) for this run only, and generates a
+corpus of invoice PDFs from the default supplier and both synthetic ones.
+Reports:
+
+1. Dispatch: detect_layout on each document's first page text, against
+   trial parsing (parse the whole text with every layout and keep the one
+   that yields the most items), which is what a registry without
+   fingerprints would have to do.
+2. parse_pdf over the whole corpus, checking every document was parsed
+   with its own layout, and how many of each supplier's item lines are
+   recovered with and without the registry.
+
+    python -m bench.bench_vendors [documents]
+"""
+import random
+import statistics
+import sys
+import time
+
+from bench.fixtures import invoice_text_lines, parsed_invoice, text_pdf
+from invoice_layouts import (
+    DEFAULT_LAYOUT, LAYOUTS, InvoiceLayout, detect_layout, register_layout, unregister_layout,
+)
+
+FILLER_LAYOUTS = 20
+LINES_PER_PAGE = 60
+
+NORTHWOOD = InvoiceLayout(
+    "northwood",
+    fingerprints=("NORTHWOOD LUMBER CO", "QTY SKU DESCRIPTION"),
+    columns=(
+        ("shipped", 0, True),
+        ("sku", 1, False),
+        ("description", slice(2, -3), False),
+        ("unit_measurement", -3, False),
+        ("price_per", -2, True),
+        ("extension", -1, False),
+    ),
+    min_columns=6,
+    table_header="AMOUNT",
+    table_end=r"SUBTOTAL",
+    invoice_marker="INVOICE NO.",
+    total_marker="TOTAL DUE",
+)
+
+RIDGELINE = InvoiceLayout(
+    "ridgeline",
+    fingerprints=("RIDGELINE BUILDING SUPPLY", "DELIVER TO"),
+    columns=(
+        ("line", 0, True),
+        ("sku", 1, False),
+        ("description", slice(2, -4), False),
+        ("ordered", -4, True),
+        ("shipped", -3, True),
+        ("price_per", -2, True),
+        ("extension", -1, False),
+    ),
+    min_columns=7,
+    table_header="EXT",
+    table_end=r"\*\*\* END OF ITEMS",
+    invoice_marker="INV#",
+    total_marker="INVOICE TOTAL",
+    ship_to_marker="DELIVER TO",
+    address_until="PH:",
+)
+
+
+def northwood_lines(response, address):
+    lines = [
+        "NORTHWOOD LUMBER CO 400 MILL RD",
+        f"INVOICE NO. {response['invoice_number']}",
+        "SHIP TO:",
+        address,
+        "QTY SKU DESCRIPTION UOM PRICE AMOUNT",
+    ]
+    for item in response["items"]:
+        lines.append(f"{item['shipped']} {item['sku']} {item['description']} "
+                     f"{item['unit_measurement']} {int(item['price_per']) / 100:.2f} {item['extension']}")
+    lines.append(f"SUBTOTAL {response['total_price']}")
+    lines.append(f"TOTAL DUE {response['total_price']}")
+    return lines
+
+
+def ridgeline_lines(response, address):
+    lines = [
+        "RIDGELINE BUILDING SUPPLY",
+        f"INV# {response['invoice_number']}",
+        "DELIVER TO",
+        f"{address} PH: 555-0199",
+        "LN ITEM DESCRIPTION ORD SHP PRICE EXT",
+    ]
+    for item in response["items"]:
+        lines.append(f"{item['line']} {item['sku']} {item['description']} {item['ordered']} "
+                     f"{item['shipped']} {int(item['price_per']) / 100:.2f} {item['extension']}")
+    lines.append("*** END OF ITEMS")
+    lines.append(f"INVOICE TOTAL {response['total_price']}")
+    return lines
+
+
+def corpus(documents, rng):
+    """[(layout name, pdf bytes, text lines, expected response)] with a random
+    mix of suppliers and invoice lengths."""
+    docs = []
+    for n in range(documents):
+        skus = [f"SKU{n}-{k}" for k in range(rng.randint(5, 150))]
+        response = parsed_invoice(800000 + n, skus)
+        vendor = rng.choice(("default", "northwood", "ridgeline"))
+        if vendor == "northwood":
+            lines = northwood_lines(response, "12 MAPLE ST")
+        elif vendor == "ridgeline":
+            lines = ridgeline_lines(response, "12 MAPLE ST")
+        else:
+            lines = invoice_text_lines(response)
+        pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+        docs.append((vendor, text_pdf(pages), lines, response))
+    return docs
+
+
+def trial_parse(lines, layouts):
+    """Pick a layout by parsing the whole text with each one."""
+    from pdf import parse_lines
+    best, best_items = DEFAULT_LAYOUT, -1
+    for layout in layouts:
+        items = len(parse_lines(lines, layout)["items"])
+        if items > best_items:
+            best, best_items = layout, items
+    return best
+
+
+def median_us(fn, docs, runs=5):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for doc in docs:
+            fn(doc)
+        samples.append((time.perf_counter() - start) / len(docs))
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    from pdf import parse_pdf
+
+    docs = corpus(documents, random.Random(1))
+    fillers = [
+        InvoiceLayout(f"filler-{n}", (f"FILLER SUPPLIER {n}", "NEVER PRINTED"), DEFAULT_LAYOUT.columns,
+                      DEFAULT_LAYOUT.min_columns, "EXTENSION", "MONDAY")
+        for n in range(FILLER_LAYOUTS)
+    ]
+    registered = fillers + [NORTHWOOD, RIDGELINE]
+    default_only = {}
+    for vendor, data, lines, expected in docs:
+        default_only[vendor] = default_only.get(vendor, 0) + len(parse_pdf(data)["items"])
+    for layout in registered:
+        register_layout(layout)
+    try:
+        first_pages = [lines[:LINES_PER_PAGE] for _, _, lines, _ in docs]
+        assert all(detect_layout(page).name == vendor for page, (vendor, *_) in zip(first_pages, docs))
+        dispatch = median_us(detect_layout, first_pages)
+        trial = median_us(lambda doc: trial_parse(doc[2], LAYOUTS + [DEFAULT_LAYOUT]), docs, runs=1)
+        print(f"{len(docs)} documents, {len(LAYOUTS) + 1} layouts registered")
+        print(f"{'dispatch from first page':<32} {dispatch:10.1f} us/document")
+        print(f"{'trial parse with every layout':<32} {trial:10.1f} us/document")
+
+        counts, expected_items = {}, {}
+        start = time.perf_counter()
+        for vendor, data, lines, expected in docs:
+            result = parse_pdf(data)
+            assert result["layout"] == vendor, (vendor, result["layout"])
+            assert [i["sku"] for i in result["items"]] == [i["sku"] for i in expected["items"]]
+            assert [i["extension"] for i in result["items"]] == [i["extension"] for i in expected["items"]]
+            assert result["invoice_number"] == expected["invoice_number"]
+            assert result["total_price"] == expected["total_price"]
+            assert result["adress"] == "12MAPLEST", result["adress"]
+            assert not result["skipped_lines"]
+            counts[vendor] = counts.get(vendor, 0) + 1
+            expected_items[vendor] = expected_items.get(vendor, 0) + len(expected["items"])
+        elapsed = time.perf_counter() - start
+    finally:
+        for layout in registered:
+            unregister_layout(layout.name)
+
+    print(f"{'parse_pdf, whole corpus':<32} {elapsed * 1000:10.1f} ms "
+          f"({elapsed / len(docs) * 1000:.1f} ms/document)")
+    print(f"\n{'supplier':<12} {'documents':>9} {'item lines':>10} {'parsed before':>14} {'parsed now':>11}")
+    for vendor in sorted(counts):
+        print(f"{vendor:<12} {counts[vendor]:9d} {expected_items[vendor]:10d} "
+              f"{default_only[vendor]:14d} {expected_items[vendor]:11d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""In-memory stand-in for an imbox.Imbox connection.
+
+Implements just the parts invoiceDownloader uses: ``messages(**filters)``
+(unread and uid__range are honoured, other filters ignored), ``mark_seen(uid)``,
+``logout()`` and the ``select``/``response`` calls on ``connection`` that read
+UIDVALIDITY. ``latency`` adds a sleep per fetched message to mimic a round
+trip to the IMAP server.
+"""
+import io
+import time
+
+
+class FakeMessage:
+    def __init__(self, subject, sent_from, attachments):
+        self.subject = subject
+        self.sent_from = [{"email": sent_from}]
+        self._attachments = attachments
+
+    @property
+    def attachments(self):
+        # Fresh file objects each time, like a newly parsed message
+        return [
+            {"filename": name, "content": io.BytesIO(data), "content-type": "application/pdf"}
+            for (name, data) in self._attachments
+        ]
+
+
+class FakeConnection:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def select(self, folder="INBOX"):
+        return "OK", [str(len(self.mailbox._messages)).encode()]
+
+    def response(self, code):
+        return code, [str(self.mailbox.uidvalidity).encode()]
+
+
+class FakeMailbox:
+    def __init__(self, latency=0.0, uidvalidity=1):
+        self.latency = latency
+        self.uidvalidity = uidvalidity
+        self._messages = []  # (uid, message)
+        self.seen = set()
+        self.connection = FakeConnection(self)
+        self.logged_out = False
+
+    def add_invoice(self, filename, data, subject="PDF", sent_from="JayKitt19@gmail.com"):
+        uid = str(len(self._messages) + 1).encode()
+        self._messages.append((uid, FakeMessage(subject, sent_from, [(filename, data)])))
+        return uid
+
+    def messages(self, unread=False, uid__range=None, **filters):
+        low = int(uid__range.split(":")[0]) if uid__range else 0
+        matched = [(uid, m) for (uid, m) in self._messages if int(uid) >= low]
+        if uid__range and not matched and self._messages:
+            matched = self._messages[-1:]  # like IMAP, "N:*" always includes the newest
+        for (uid, message) in matched:
+            if unread and uid in self.seen:
+                continue
+            if self.latency:
+                time.sleep(self.latency)
+            yield (uid, message)
+
+    def mark_seen(self, uid):
+        self.seen.add(uid)
+
+    def logout(self):
+        self.logged_out = True
@@ -0,0 +1,121 @@
+"""Synthetic invoice data shaped like the output of ``pdf.parse_pdf``."""
+import random
+
+
+def invoice_line(n, sku, shipped=None):
+    shipped = shipped if shipped is not None else random.randint(1, 50)
+    price = random.randint(100, 5000)
+    return {
+        "line": str(n),
+        "shipped": str(shipped),
+        "ordered": str(shipped),
+        "unit_measurement": "PC",
+        "sku": sku,
+        "description": f"2X4 SPF STUD {sku}",
+        "location": "YARD",
+        "units": "1",
+        "price_per": str(price),
+        "extension": f"{shipped * price / 100:.2f}",
+    }
+
+
+def parsed_invoice(invoice_number, skus, address="12MAPLEST"):
+    """A parse_pdf-style response with one line per SKU."""
+    items = [invoice_line(n + 1, sku) for n, sku in enumerate(skus)]
+    total = sum(float(i["extension"]) for i in items)
+    return {
+        "items": items,
+        "skipped_lines": [],
+        "invoice_number": str(invoice_number),
+        "invoice_used": False,
+        "total_price": f"{total:.2f}",
+        "error": "",
+        "adress": address,
+    }
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def text_pdf(pages):
+    """Minimal PDF with one Courier text line per entry, one page per list."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        stream = ["BT /F1 8 Tf 10 TL 24 770 Td"]
+        for line in lines:
+            stream.append(f"({_pdf_escape(line)}) Tj T*")
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (n, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def invoice_text_lines(response, address_words=("12", "MAPLE", "ST")):
+    """Render a parsed_invoice() response back into the supplier's text layout."""
+    lines = [
+        f"INVOICE: {response['invoice_number']}",
+        "SHIP TO:",
+        "CATALYST WOOD LLC " + " ".join(address_words) + " DEL. 555-0100",
+        "LN SHP ORD UM ITEM DESCRIPTION LOC UNITS PRICE PER EXTENSION",
+    ]
+    for item in response["items"]:
+        price = int(item["price_per"])
+        lines.append(
+            f"{item['line']} {item['shipped']} {item['ordered']} {item['unit_measurement']} "
+            f"{item['sku']} {item['description']} {item['location']} {item['units']} "
+            f"{price / 100:.2f} PC {item['extension']}"
+        )
+    lines.append("MONDAY")
+    lines.append(f"TOTAL {response['total_price']}")
+    return lines
+
+
+def invoice_pdf(invoice_number, skus, lines_per_page=60, address_words=("12", "MAPLE", "ST")):
+    """Generate (pdf_bytes, expected_response) for an invoice with one line per SKU."""
+    response = parsed_invoice(invoice_number, skus, address="".join(address_words))
+    text = invoice_text_lines(response, address_words)
+    pages = [text[i:i + lines_per_page] for i in range(0, len(text), lines_per_page)]
+    return text_pdf(pages), response
+
+
+TERMS_LINE = "Payment is due within thirty days of the date shown above, finance charges apply after"
+
+
+def multipage_invoice_pdf(invoice_number, skus, lines_per_page=50, terms_pages=3):
+    """Like invoice_pdf, but continuation pages repeat the letterhead and
+    column header, and the invoice ends with pages of terms and conditions."""
+    response = parsed_invoice(invoice_number, skus)
+    text = invoice_text_lines(response)
+    header, body = text[:4], text[4:]
+    pages = [header + body[:lines_per_page]]
+    for n, start in enumerate(range(lines_per_page, len(body), lines_per_page), start=2):
+        pages.append([f"CATALYST SUPPLY PAGE {n}", f"INVOICE: {invoice_number}", header[3]]
+                     + body[start:start + lines_per_page])
+    for _ in range(terms_pages):
+        pages.append([TERMS_LINE] * 70)
+    return text_pdf(pages), response
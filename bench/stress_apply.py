@@ -0,0 +1,177 @@
+"""Multi-process stress test of the invoice apply path.
+
+Several processes apply invoices to the same projects at once, through the
+same apply_pdf_to_project call the upload, email and job paths use. Every
+invoice is applied by two processes, so half the attempts must be rejected
+as duplicates. Afterwards the stored totals are checked against the sums
+computed from the invoices themselves: any lost update or double-applied
+invoice shows up as a mismatch and the script exits non-zero.
+
+    python -m bench.stress_apply [--processes 4] [--invoices 200]
+
+Set DATABASE_URL to run it against Postgres instead of a throwaway SQLite
+file (the tables are created by the migrations; use an empty database).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+from bench.fixtures import parsed_invoice
+from bench.util import make_app
+
+PROJECTS = 3
+ITEMS = 40
+NEW_SKUS = 10
+
+
+def build_invoices(count, seed):
+    """(project index, response) pairs: existing SKUs, SKUs no project has
+    yet and the odd repeated SKU within one invoice."""
+    rng = random.Random(seed)
+    invoices = []
+    for number in range(count):
+        n = rng.randrange(PROJECTS)
+        skus = rng.sample([f"SKU{n}-{k}" for k in range(ITEMS)], 8)
+        skus += rng.sample([f"NEW{n}-{k}" for k in range(NEW_SKUS)], 2)
+        skus.append(skus[0])
+        invoices.append((n, parsed_invoice(500000 + number, skus, address=f"STRESS {n}")))
+    return invoices
+
+
+def worker(db_url, project_ids, invoices, order_seed, barrier, out):
+    app = make_app(db_url)
+    from models import db, Project
+    from pdf import apply_pdf_to_project
+
+    order = list(range(len(invoices)))
+    random.Random(order_seed).shuffle(order)
+    applied = duplicates = errors = 0
+    barrier.wait()
+    with app.app_context():
+        for i in order:
+            n, response = invoices[i]
+            response = dict(response, items=[dict(line) for line in response["items"]])
+            try:
+                project = db.session.get(Project, project_ids[n])
+                apply_pdf_to_project(project, response)
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                print(f"[{os.getpid()}] invoice {response['invoice_number']}: {e}", file=sys.stderr)
+                continue
+            if response["invoice_used"]:
+                duplicates += 1
+            else:
+                applied += 1
+    out.put((applied, duplicates, errors))
+
+
+def expected_totals(invoices):
+    items = defaultdict(lambda: [0, 0.0])
+    costs = defaultdict(float)
+    for n, response in invoices:
+        costs[n] += round(float(response["total_price"]), 2)
+        for line in response["items"]:
+            item = items[(n, line["sku"])]
+            item[0] += int(line["shipped"])
+            item[1] += round(float(line["extension"]), 2)
+    return items, costs
+
+
+def check(app, project_ids, invoices):
+    """List of mismatches between the database and the invoices."""
+    from models import db, Project, BudgetItem, Invoice
+
+    items, costs = expected_totals(invoices)
+    problems = []
+    with app.app_context():
+        for n, pid in enumerate(project_ids):
+            project = db.session.get(Project, pid)
+            if abs(project.total_cost - costs[n]) > 0.005:
+                problems.append(f"project {n}: total_cost {project.total_cost:.2f} != {costs[n]:.2f}")
+            expected_invoices = sum(1 for m, _ in invoices if m == n)
+            count = Invoice.query.filter_by(project_id=pid).count()
+            if count != expected_invoices:
+                problems.append(f"project {n}: {count} invoices != {expected_invoices}")
+            total_received, total_paid = 0, 0.0
+            for item in BudgetItem.query.filter_by(project_id=pid):
+                received, payed = items.pop((n, item.sku), (0, 0.0))
+                if item.received != received or abs(item.total_payed - payed) > 0.005:
+                    problems.append(f"project {n} {item.sku}: received {item.received}, payed "
+                                    f"{item.total_payed:.2f} != {received}, {payed:.2f}")
+                total_received += item.received
+                total_paid += item.total_payed
+            if project.total_received != total_received or abs(project.total_paid - total_paid) > 0.005:
+                problems.append(f"project {n}: rollups {project.total_received}, {project.total_paid:.2f} "
+                                f"!= {total_received}, {total_paid:.2f}")
+    problems.extend(f"project {n} {sku}: never created" for (n, sku) in items)
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--invoices", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    db_url = os.environ.get("DATABASE_URL")
+    app = make_app(db_url)
+    db_url = os.environ["DATABASE_URL"]
+    from models import db, Project, BudgetItem
+
+    with app.app_context():
+        projects = [Project(name=f"STRESS {n}") for n in range(PROJECTS)]
+        db.session.add_all(projects)
+        db.session.flush()
+        project_ids = [p.id for p in projects]
+        db.session.execute(db.insert(BudgetItem), [
+            {"project_id": pid, "sku": f"SKU{n}-{k}", "material_name": f"2X4 SPF STUD {k}",
+             "quantity": 100, "received": 0, "total_payed": 0, "extra_data": {}}
+            for n, pid in enumerate(project_ids) for k in range(ITEMS)
+        ])
+        db.session.commit()
+
+    invoices = build_invoices(args.invoices, args.seed)
+    # Each process gets every other slice, so each invoice is attempted twice
+    slices = [invoices[i::args.processes] for i in range(args.processes)]
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.processes)
+    out = context.Queue()
+    procs = [
+        context.Process(target=worker, args=(
+            db_url, project_ids, slices[i] + slices[(i + 1) % args.processes], args.seed + i, barrier, out,
+        ))
+        for i in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    counts = [out.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+
+    applied = sum(c[0] for c in counts)
+    duplicates = sum(c[1] for c in counts)
+    errors = sum(c[2] for c in counts)
+    print(f"{args.processes} processes, {applied + duplicates + errors} attempts "
+          f"in {elapsed:.2f}s: {applied} applied, {duplicates} duplicates, {errors} errors")
+
+    problems = check(app, project_ids, invoices)
+    if applied != len(invoices):
+        problems.append(f"{applied} invoices applied, expected {len(invoices)}")
+    for problem in problems[:20]:
+        print("MISMATCH", problem)
+    if problems or errors:
+        sys.exit(1)
+    print("Totals match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Helpers shared by the benchmark scripts in this folder.
+
+Run any benchmark from the repository root, e.g. ``python -m bench.bench_projects``.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+def make_app(db_url=None):
+    """Create the Flask app against a throwaway SQLite database and migrate it."""
+    if db_url is None:
+        tmpdir = tempfile.mkdtemp(prefix="catalyst-bench-")
+        db_url = "sqlite:///" + os.path.join(tmpdir, "bench.db")
+    os.environ["DATABASE_URL"] = db_url
+    from app import create_app
+    from migrations import migrate
+    app = create_app()
+    with app.app_context():
+        migrate()
+    return app
+
+
+class QueryCounter:
+    """Counts SQL statements issued on an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+@contextmanager
+def timed(label, results=None):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    if results is not None:
+        results[label] = elapsed
+    print(f"{label:<40} {elapsed * 1000:10.2f} ms")
@@ -0,0 +1,99 @@
+"""gzip / brotli compression of large responses.
+
+Responses of at least COMPRESS_MIN_BYTES with a text or JSON mimetype are
+compressed with the best encoding the client accepts: brotli if the Brotli
+package is installed, otherwise gzip. Streaming responses (exports) and
+bodiless ones (304s) are left alone.
+
+A compressed body is a different representation, so its ETag gets a suffix
+(p12.5f1c-v3 becomes p12.5f1c-v3-gzip) and Vary: Accept-Encoding is added.
+Bodies served from payload_cache are kept there compressed too, under their
+own cache key plus the encoding, so repeat reads of an unchanged project
+don't compress it again.
+"""
+import gzip
+import os
+
+from flask import request
+
+from payload_cache import payload_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE = ("application/json", "application/javascript", "image/svg+xml")
+
+
+def available_encodings():
+    """Supported encodings in order of preference."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def negotiate():
+    """The encoding to use for the current request, or None."""
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def etag_variants(etag):
+    """Every ETag a client may hold for a body tagged etag: plain or compressed."""
+    return [etag] + [f"{etag}-{encoding}" for encoding in available_encodings()]
+
+
+def is_compressible(response):
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE
+
+
+def compress_response(response):
+    """after_request hook."""
+    if not is_compressible(response) or "Content-Encoding" in response.headers:
+        return response
+    if response.status_code == 304:
+        # Echo the tag of the representation the client holds
+        etag, weak = response.get_etag()
+        encoding = negotiate()
+        if etag and encoding and request.if_none_match.contains(f"{etag}-{encoding}"):
+            response.set_etag(f"{etag}-{encoding}", weak)
+        response.vary.add("Accept-Encoding")
+        return response
+    if response.is_streamed or response.direct_passthrough or response.status_code < 200:
+        return response
+    if response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    source_key = getattr(response, "payload_cache_key", None)
+    cache_key = source_key + ("compressed", encoding) if source_key else None
+    entry = payload_cache.get(cache_key) if cache_key else None
+    if entry is None:
+        body = compress(response.get_data(), encoding)
+        if cache_key:
+            payload_cache.put(cache_key, body)
+    else:
+        body, _ = entry
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,74 @@
+"""Engine settings for SQLite (local/dev) and Postgres (DATABASE_URL).
+
+SQLite connections are switched to WAL with synchronous=NORMAL and a busy
+timeout, so several gunicorn workers can write without "database is
+locked" errors. Postgres gets a sized, pre-pinged pool and a per-statement
+timeout. Everything can be tuned through the environment:
+
+  SQLITE_BUSY_TIMEOUT_MS   how long a writer waits for the lock (default 15000)
+  DB_POOL_SIZE             Postgres connections kept per process (default 5)
+  DB_MAX_OVERFLOW          extra connections allowed under load (default 10)
+  DB_POOL_RECYCLE          seconds before a connection is replaced (default 1800)
+  DB_STATEMENT_TIMEOUT_MS  Postgres statement_timeout, 0 to disable (default 30000);
+                           migrations run without it
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 15000))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 30000))
+
+
+def database_url(default_sqlite_path):
+    """DATABASE_URL, or a SQLite file at default_sqlite_path.
+
+    Hosts still hand out postgres:// URLs, which SQLAlchemy 1.4+ rejects.
+    """
+    url = os.environ.get("DATABASE_URL")
+    if not url:
+        return f"sqlite:///{default_sqlite_path}"
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for url."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        return {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    if backend == "postgresql":
+        options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+        if DB_STATEMENT_TIMEOUT_MS:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+        return options
+    return {"pool_pre_ping": True}
+
+
+def configure(app, default_sqlite_path, url=None):
+    url = url or database_url(default_sqlite_path)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # journal_mode is stored in the file; the others are per connection
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
@@ -0,0 +1,160 @@
+"""Streaming exports of projects, budget items and applied invoices.
+
+GET /api/export/<dataset>.<format> where dataset is projects, items,
+invoices or invoice-lines and format is ndjson or csv.
+
+Rows are read from a server-side cursor in batches and written to the
+response as they arrive, so memory use does not grow with the table.
+
+Filters (all optional):
+  project_id -- repeatable; only these projects
+  since      -- ISO date/time; created on or after (items use their project's date)
+  until      -- ISO date/time; created before
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from models import db, Project, BudgetItem, Invoice, InvoiceLine
+
+export_bp = Blueprint('export', __name__, url_prefix='/api/export')
+
+BATCH_SIZE = 1000
+
+DATASETS = {
+    "projects": (
+        [
+            ("id", Project.id),
+            ("name", Project.name),
+            ("created_at", Project.created_at),
+            ("total_cost", Project.total_cost),
+            ("total_paid", Project.total_paid),
+            ("total_received", Project.total_received),
+            ("budget_quantity", Project.budget_quantity),
+            ("budget_received", Project.budget_received),
+            ("over_budget_count", Project.over_budget_count),
+        ],
+        Project.created_at,
+        Project.id,
+    ),
+    "items": (
+        [
+            ("id", BudgetItem.id),
+            ("project_id", BudgetItem.project_id),
+            ("project_name", Project.name),
+            ("sku", BudgetItem.sku),
+            ("material_name", BudgetItem.material_name),
+            ("quantity", BudgetItem.quantity),
+            ("received", BudgetItem.received),
+            ("total_payed", BudgetItem.total_payed),
+            ("location", BudgetItem.location),
+            ("um", BudgetItem.um),
+            ("price_per", BudgetItem.price_per),
+        ],
+        Project.created_at,
+        BudgetItem.project_id,
+    ),
+    "invoices": (
+        [
+            ("id", Invoice.id),
+            ("project_id", Invoice.project_id),
+            ("invoice_number", Invoice.invoice_number),
+            ("total_price", Invoice.total_price),
+            ("adress", Invoice.adress),
+            ("applied_at", Invoice.created_at),
+        ],
+        Invoice.created_at,
+        Invoice.project_id,
+    ),
+    "invoice-lines": (
+        [
+            ("invoice_id", Invoice.id),
+            ("project_id", Invoice.project_id),
+            ("invoice_number", Invoice.invoice_number),
+            ("applied_at", Invoice.created_at),
+        ] + [(field, getattr(InvoiceLine, field)) for field in InvoiceLine.FIELDS],
+        Invoice.created_at,
+        Invoice.project_id,
+    ),
+}
+
+
+def _export_query(dataset, project_ids, since, until):
+    columns, date_column, project_column = DATASETS[dataset]
+    stmt = db.select(*[column.label(name) for name, column in columns])
+    if dataset == "items":
+        stmt = stmt.join(Project, Project.id == BudgetItem.project_id)
+        order = (BudgetItem.project_id, BudgetItem.id)
+    elif dataset == "invoice-lines":
+        stmt = stmt.select_from(InvoiceLine).join(Invoice, Invoice.id == InvoiceLine.invoice_id)
+        order = (Invoice.id, InvoiceLine.position)
+    else:
+        order = (columns[0][1],)
+    if project_ids:
+        stmt = stmt.where(project_column.in_(project_ids))
+    if since is not None:
+        stmt = stmt.where(date_column >= since)
+    if until is not None:
+        stmt = stmt.where(date_column < until)
+    return stmt.order_by(*order).execution_options(yield_per=BATCH_SIZE)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _ndjson(names, rows):
+    for batch in rows.partitions():
+        yield "".join(
+            json.dumps(dict(zip(names, map(_plain, row)))) + "\n" for row in batch
+        )
+
+
+def _csv(names, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in rows.partitions():
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+@export_bp.route('/<dataset>.<fmt>', methods=['GET'])
+def export_dataset(dataset, fmt):
+    if dataset not in DATASETS or fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "Not found"}), 404
+    try:
+        project_ids = [int(pid) for pid in request.args.getlist("project_id")]
+        since = _parse_date(request.args.get("since"))
+        until = _parse_date(request.args.get("until"))
+    except ValueError:
+        return jsonify({"error": "project_id must be an integer and since/until ISO dates"}), 400
+
+    names = [name for name, _ in DATASETS[dataset][0]]
+    stmt = _export_query(dataset, project_ids, since, until)
+
+    def generate():
+        rows = db.session.execute(stmt)
+        try:
+            yield from (_ndjson if fmt == "ndjson" else _csv)(names, rows)
+        finally:
+            rows.close()
+
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{dataset}.{fmt}"'
+    return resp
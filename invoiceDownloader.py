@@ -1,57 +1,203 @@
-import os 
-from imbox import Imbox
-import traceback
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
 
-from pdf import apply_pdf_via_email
+from sqlalchemy.orm import undefer
+
+from models import db, MailRetry
+from archive import archive_pdf
+from jobs import parse_pool, JOB_WORKERS
+from parse_cache import pdf_digest
+from pdf import parse_pdf_timed, timed_result, parse_cache, apply_parsed_email
 
 host = "imap.gmail.com"
 username = os.environ.get('GMAIL_USERNAME', 'JayKitt19@gmail.com')
 password = os.environ.get('GMAIL_PASSWORD', 'hicc qfxd rbgg inxe')
-pdfFolder = "./invoicePDFs"
 
-def download_and_process_invoices(app):
-    """Download PDF invoices from email and process them with Flask app context."""
+INVOICE_SEARCH = {"subject": "PDF", "sent_from": "JayKitt19@gmail.com", "raw": "has:attachment"}
+
+# Attachments parsed concurrently before the fetch stage waits for results
+MAX_IN_FLIGHT = int(os.environ.get('INVOICE_PIPELINE_DEPTH', JOB_WORKERS * 2))
+
+# Failed attachments are retried after RETRY_BASE_SECONDS, doubling each time
+RETRY_BASE_SECONDS = int(os.environ.get('MAIL_RETRY_BASE_SECONDS', 60))
+RETRY_MAX_SECONDS = 6 * 3600
+RETRY_MAX_ATTEMPTS = int(os.environ.get('MAIL_RETRY_MAX_ATTEMPTS', 6))
+RETRY_BATCH = 20
+
+log = logging.getLogger(__name__)
+
+
+def open_mailbox():
+    from imbox import Imbox  # only the processes that poll mail need it
+    return Imbox(host, username=username, password=password, ssl=True, ssl_context=None, starttls=False)
+
+
+def uid_validity(mail):
+    """UIDVALIDITY of the inbox. Re-selects it, so it also checks the
+    connection is still alive."""
+    mail.connection.select()
+    _, data = mail.connection.response("UIDVALIDITY")
+    return int(data[0])
+
+
+def fetch_attachments(mail, after_uid=None):
+    """Fetch stage: lazily yield (uid, [(filename, sha256, pdf_bytes), ...]) per matching message.
+
+    With after_uid, fetches every matching message with a higher UID, read or
+    not; otherwise every unread one. Messages are pulled from the server one
+    at a time as the pipeline asks for them rather than listed up front.
+    Attachment bytes stay in memory; they are only written to disk if the
+    invoice archive is enabled.
+    """
+    if after_uid is None:
+        messages = mail.messages(unread=True, **INVOICE_SEARCH)
+    else:
+        messages = mail.messages(uid__range=f"{after_uid + 1}:*", **INVOICE_SEARCH)
+    for (uid, message) in messages:
+        # "N:*" always matches the newest message, even when its UID is below N
+        if after_uid is not None and int(uid) <= after_uid:
+            continue
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Email UID=%s, Subject=%r, Attachments=%d", uid, message.subject, len(message.attachments))
+        downloaded = []
+        for attachment in message.attachments:
+            data = attachment.get('content').read()
+            digest = pdf_digest(data)
+            archive_pdf(data, digest)
+            downloaded.append((attachment.get('filename'), digest, data))
+        yield (uid, downloaded)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def queue_retry(uid, filename, digest, data, error):
+    """Store a failed attachment so retry_failed_attachments tries it again later."""
+    db.session.add(MailRetry(
+        uid=str(int(uid)), filename=filename or "", sha256=digest, payload=data,
+        error=error, next_attempt_at=datetime.utcnow() + retry_delay(1),
+    ))
+    db.session.commit()
+
+
+def process_mailbox(mail, after_uid=None):
+    """Run the ingestion pipeline over mail. Call inside an app context.
+
+    Runs as a three stage pipeline: attachments are fetched as a stream,
+    parsed in the shared process pool, and applied to the database one at a
+    time by this thread, which is the only writer. An attachment that fails
+    is queued in mail_retries. A message is marked seen once every one of its
+    attachments has been applied or queued.
+
+    Returns a dict with the messages found, attachments processed and
+    queued for retry, the highest UID handled, and the last apply response.
+    """
+    pool = parse_pool()
+    result = {"found": 0, "processed": 0, "queued": 0, "last_uid": after_uid or 0, "resp": {}}
+    pending = {}   # future -> (uid, filename, sha256, bytes)
+    remaining = {}  # uid -> attachments not yet applied
+    failed = set()
+
+    def apply_one(uid, att_fn, digest, data, get_response, fresh=False):
+        """Writer stage. fresh parses are added to the parse cache."""
+        try:
+            response = get_response()
+            if fresh:
+                parse_cache.put(digest, response)
+            result["resp"] = apply_parsed_email(response)
+            result["processed"] += 1
+            log.info("Successfully processed: %s", att_fn)
+        except Exception as e:
+            db.session.rollback()
+            log.exception("Error processing %s, queued for retry", att_fn)
+            try:
+                queue_retry(uid, att_fn, digest, data, str(e))
+                result["queued"] += 1
+            except Exception:
+                db.session.rollback()
+                log.exception("Could not queue %s for retry", att_fn)
+                failed.add(uid)
+        remaining[uid] -= 1
+        if remaining[uid] == 0 and uid not in failed:
+            mail.mark_seen(uid)
+
+    def apply_done(done):
+        for future in done:
+            uid, att_fn, digest, data = pending.pop(future)
+            apply_one(uid, att_fn, digest, data, lambda: timed_result(future), fresh=True)
+
+    for (uid, attachments) in fetch_attachments(mail, after_uid):
+        result["found"] += 1
+        result["last_uid"] = max(result["last_uid"], int(uid))
+        remaining[uid] = len(attachments)
+        for (att_fn, digest, data) in attachments:
+            cached = parse_cache.get(digest)
+            if cached is not None:
+                apply_one(uid, att_fn, digest, data, lambda: cached)
+            else:
+                pending[pool.submit(parse_pdf_timed, data)] = (uid, att_fn, digest, data)
+        while len(pending) >= MAX_IN_FLIGHT:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            apply_done(done)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        apply_done(done)
+    return result
+
+
+def retry_failed_attachments(limit=RETRY_BATCH):
+    """Retry queued attachments whose backoff has passed. Call inside an app
+    context. Returns the number that succeeded."""
+    due = (
+        MailRetry.query.options(undefer(MailRetry.payload))
+        .filter(MailRetry.status == MailRetry.PENDING, MailRetry.next_attempt_at <= datetime.utcnow())
+        .order_by(MailRetry.next_attempt_at)
+        .limit(limit)
+        .all()
+    )
+    due = [(retry.id, retry.filename, retry.sha256, retry.payload) for retry in due]
+    db.session.commit()  # don't hold a read transaction across the parses
+    succeeded = 0
+    for retry_id, filename, digest, data in due:
+        try:
+            response = parse_cache.get(digest)
+            if response is None:
+                response = timed_result(parse_pool().submit(parse_pdf_timed, data))
+                parse_cache.put(digest, response)
+            apply_parsed_email(response)
+            retry = db.session.get(MailRetry, retry_id)
+            retry.status = MailRetry.DONE
+            retry.payload = None
+            succeeded += 1
+        except Exception as e:
+            db.session.rollback()
+            retry = db.session.get(MailRetry, retry_id)
+            retry.attempts += 1
+            retry.error = str(e)
+            if retry.attempts >= RETRY_MAX_ATTEMPTS:
+                retry.status = MailRetry.DEAD
+                log.error("Giving up on %s after %d attempts: %s", filename, retry.attempts, e)
+            else:
+                retry.next_attempt_at = datetime.utcnow() + retry_delay(retry.attempts)
+                log.warning("Retry %d of %s failed: %s", retry.attempts, filename, e)
+        db.session.commit()
+    return succeeded
+
+
+def download_and_process_invoices(app, mail=None):
+    """Download unread PDF invoices from email and process them with Flask app context."""
     with app.app_context():
-        if not os.path.isdir(pdfFolder):
-            os.makedirs(pdfFolder, exist_ok=True)
-
-        mail = Imbox(host, username=username, password=password, ssl=True, ssl_context=None, starttls=False)
-
-        messages = mail.messages(subject='PDF', unread=True, sent_from="JayKitt19@gmail.com", raw = "has:attachment")
-        processed_count = 0
-        resp = {}
-        
-        messages_list = list(messages)
-        print(f"Found {len(messages_list)} emails matching criteria")
-        
-        if len(messages_list) == 0:
-            print("No emails found with subject 'PDF', unread=True, from 'JayKitt19@gmail.com' with attachments")
+        if mail is None:
+            mail = open_mailbox()
+        result = process_mailbox(mail)
+
+        if result["found"] == 0:
+            log.info("No emails found with subject 'PDF', unread=True, from 'JayKitt19@gmail.com' with attachments")
             resp = {'error' : 'No new invoices in the inbox'}
-            return (resp, processed_count)
-        
-        # Print details about each email found
-        for i, (uid, message) in enumerate(messages_list):
-            print(f"Email {i+1}: UID={uid}, Subject='{message.subject}', From='{message.sent_from}', Attachments={len(message.attachments)}")
-        for (uid, message) in messages_list:
-            print(uid)
-            for idx, attachment in enumerate(message.attachments):
-
-                try:
-                    
-                    att_fn = attachment.get('filename')
-                    download_path = f"{pdfFolder}/{att_fn}"
-                    print(f"Processing: {att_fn}")
-                    with open(download_path, "wb") as fp:
-                       fp.write(attachment.get('content').read())
-                    
-                    resp = apply_pdf_via_email(download_path)
-                    processed_count += 1
-                    print(f"Successfully processed: {att_fn}")
-                    mail.mark_seen(uid)
-                except Exception as e:
-                    print(f"Error processing {att_fn}: {str(e)}")
-                    print(traceback.print_exc())
-                
-        
-        print(f"Processed {processed_count} invoices")
-        return (resp, processed_count)
\ No newline at end of file
+            return (resp, result["processed"])
+
+        log.info("Processed %d invoices", result["processed"])
+        return (result["resp"], result["processed"])
@@ -0,0 +1,168 @@
+"""Supplier invoice layouts and the registry parse_pdf picks them from.
+
+Each InvoiceLayout declares the fingerprints that identify its invoices,
+the markers for the invoice number, total and ship-to address, and the
+column map of an item row. parse_pdf reads the first page, asks
+detect_layout for the layout whose fingerprints all appear in it, and
+parses the whole document with that one layout; nothing is parsed twice.
+Invoices that match no registered layout are parsed as DEFAULT_LAYOUT, the
+supplier this app was written for.
+
+Adding a supplier means describing its layout and registering it:
+
+    register_layout(InvoiceLayout(
+        "acme",
+        fingerprints=("ACME LUMBER", "QTY SHIPPED"),
+        columns=(("shipped", 0, True), ("sku", 1, False), ...),
+        min_columns=6,
+        table_header="AMOUNT",
+        table_end=r"SUBTOTAL",
+    ))
+
+Register layouts in this module (or one it imports), so the parse pool's
+worker processes see them too. Cached parses don't need invalidating by
+hand: registry_signature() is part of the parse cache's version, so adding,
+replacing or removing a layout makes every cached parse a miss.
+"""
+import re
+
+# Every item dict has these keys; fields a layout has no column for are ""
+ITEM_FIELDS = (
+    "line", "shipped", "ordered", "unit_measurement", "sku",
+    "description", "location", "units", "price_per", "extension",
+)
+
+# Applying an invoice needs these, so every layout must have a column for them
+REQUIRED_FIELDS = ("sku", "shipped", "extension")
+
+NON_DIGITS = re.compile(r"\D")
+
+DAYS_OF_WEEK = ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY")
+
+
+class InvoiceLayout:
+    """How one supplier prints its invoices.
+
+    fingerprints -- strings that all appear on the first page of this
+                    supplier's invoices (and, together, on no one else's)
+    columns      -- (field, column index or slice, keep digits only) per
+                    item field, indexing the whitespace-split item row
+    min_columns  -- shorter rows in the item table are reported as skipped
+    table_header -- a word on the column header row; item rows follow it
+    table_end    -- regex matched against a stripped, upper-cased line that
+                    ends the item table
+    address_after / address_until -- the ship-to address is the words of
+                    the lines after the ship-to marker between these two
+                    words (from the first word if address_after is None)
+    """
+
+    def __init__(self, name, fingerprints, columns, min_columns, table_header,
+                 table_end, invoice_marker="INVOICE:", total_marker="TOTAL",
+                 ship_to_marker="SHIP TO:", address_after=None, address_until=None):
+        self.name = name
+        self.fingerprints = tuple(fingerprints)
+        self.columns = tuple(columns)
+        self.min_columns = min_columns
+        self.table_header = table_header
+        self.table_end = re.compile(table_end)
+        self.invoice_marker = invoice_marker
+        self.total_marker = total_marker
+        self.ship_to_marker = ship_to_marker
+        self.address_after = address_after
+        self.address_until = address_until
+        self.fields = frozenset(field for field, _, _ in self.columns)
+        missing = [field for field in REQUIRED_FIELDS if field not in self.fields]
+        if missing:
+            raise ValueError(f"layout {name!r} has no column for {', '.join(missing)}")
+        self.missing_fields = tuple(field for field in ITEM_FIELDS if field not in self.fields)
+        self.checks_ordered = "ordered" in self.fields
+        # build_item's column plan, sorted out once rather than per row
+        self._blank_item = dict.fromkeys(self.missing_fields, "")
+        self._text_columns = tuple(
+            (field, column) for field, column, digits in self.columns
+            if not digits and not isinstance(column, slice)
+        )
+        self._digit_columns = tuple(
+            (field, column) for field, column, digits in self.columns
+            if digits and not isinstance(column, slice)
+        )
+        self._joined_columns = tuple(
+            (field, column, digits) for field, column, digits in self.columns if isinstance(column, slice)
+        )
+        self.signature = repr((
+            name, self.fingerprints, self.columns, min_columns, table_header, table_end,
+            invoice_marker, total_marker, ship_to_marker, address_after, address_until,
+        ))
+
+    def build_item(self, split_line):
+        """The item dict for a whitespace-split item row."""
+        item = self._blank_item.copy()
+        for field, column in self._text_columns:
+            item[field] = split_line[column]
+        for field, column in self._digit_columns:
+            value = split_line[column]
+            item[field] = value if value.isdecimal() else NON_DIGITS.sub("", value)
+        for field, column, digits in self._joined_columns:
+            value = " ".join(split_line[column])
+            item[field] = NON_DIGITS.sub("", value) if digits else value
+        return item
+
+    def matches(self, text):
+        return all(fingerprint in text for fingerprint in self.fingerprints)
+
+    def __repr__(self):
+        return f"<InvoiceLayout {self.name}>"
+
+
+DEFAULT_LAYOUT = InvoiceLayout(
+    "default",
+    fingerprints=(),  # never matched; it is what detect_layout falls back to
+    columns=(
+        ("line", 0, True),
+        ("shipped", 1, True),
+        ("ordered", 2, True),
+        ("unit_measurement", 3, False),
+        ("sku", 4, False),
+        ("description", slice(5, 9), False),
+        ("location", 9, False),
+        ("units", 10, False),
+        ("price_per", 11, True),
+        ("extension", 13, False),
+    ),
+    min_columns=14,
+    table_header="EXTENSION",
+    table_end="(" + "|".join(DAYS_OF_WEEK) + ")$",
+    address_after="LLC",
+    address_until="DEL.",
+)
+
+# Checked in order; register the most specific layouts first
+LAYOUTS = []
+
+
+def register_layout(layout):
+    """Add layout to the registry. Replaces a layout with the same name."""
+    LAYOUTS[:] = [existing for existing in LAYOUTS if existing.name != layout.name]
+    LAYOUTS.append(layout)
+    return layout
+
+
+def unregister_layout(name):
+    LAYOUTS[:] = [layout for layout in LAYOUTS if layout.name != name]
+
+
+def registry_signature():
+    """A string that changes whenever the registered layouts do."""
+    return "|".join(layout.signature for layout in [DEFAULT_LAYOUT] + LAYOUTS)
+
+
+def detect_layout(first_page):
+    """The layout for an invoice whose first page reads first_page (a string
+    or a list of lines): the first registered layout whose fingerprints all
+    appear in it, else DEFAULT_LAYOUT."""
+    if not isinstance(first_page, str):
+        first_page = "\n".join(first_page)
+    for layout in LAYOUTS:
+        if layout.matches(first_page):
+            return layout
+    return DEFAULT_LAYOUT
@@ -0,0 +1,175 @@
+"""Filtered, sorted and paginated budget item queries.
+
+Backs GET /api/projects/<id>/items. Material name search uses a trigram
+index where the database has one: an FTS5 table with the trigram tokenizer
+on SQLite, pg_trgm on Postgres (which speeds up ILIKE by itself). Both are
+created by migrations.promote_item_fields; without them the search falls
+back to a plain case-insensitive LIKE.
+"""
+import base64
+import json
+
+from sqlalchemy import and_, func, literal_column, or_, text
+
+from models import db, BudgetItem
+
+FTS_TABLE = "budget_items_fts"
+# The trigram tokenizer can't match anything shorter than this
+FTS_MIN_CHARS = 3
+
+SORT_COLUMNS = {
+    "sku": BudgetItem.sku,
+    "material": BudgetItem.material_name,
+    "quantity": BudgetItem.quantity,
+    "received": BudgetItem.received,
+    "shortfall": BudgetItem.quantity - BudgetItem.received,
+    "total_payed": BudgetItem.total_payed,
+    # Nulls sort first, and keyset comparisons need non-null values. Literal
+    # defaults so the expressions match the indexes declared on BudgetItem.
+    "location": func.coalesce(BudgetItem.location, literal_column("''")),
+    "um": func.coalesce(BudgetItem.um, literal_column("''")),
+    "price_per": func.coalesce(BudgetItem.price_per, literal_column("-1")),
+}
+
+_fts_available = {}
+
+
+def install_text_index():
+    """Create the material name trigram index for the current database.
+
+    Returns True if one exists afterwards.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "material_name, content='budget_items', content_rowid='id', tokenize='trigram')"
+                ))
+                # Keep the external-content table in step with budget_items
+                db.session.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS budget_items_fts_insert AFTER INSERT ON budget_items BEGIN "
+                    f"INSERT INTO {FTS_TABLE}(rowid, material_name) VALUES (new.id, new.material_name); END"
+                ))
+                db.session.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS budget_items_fts_delete AFTER DELETE ON budget_items BEGIN "
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, material_name) "
+                    f"VALUES ('delete', old.id, old.material_name); END"
+                ))
+                db.session.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS budget_items_fts_update AFTER UPDATE OF material_name ON budget_items "
+                    "WHEN old.material_name IS NOT new.material_name BEGIN "
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, material_name) "
+                    f"VALUES ('delete', old.id, old.material_name); "
+                    f"INSERT INTO {FTS_TABLE}(rowid, material_name) VALUES (new.id, new.material_name); END"
+                ))
+                db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        except Exception:
+            db.session.commit()
+            return False  # no FTS5 or no trigram tokenizer (SQLite < 3.34); LIKE still works
+        db.session.commit()
+        return True
+    if dialect == "postgresql":
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                db.session.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_budget_items_material_trgm "
+                    "ON budget_items USING gin (material_name gin_trgm_ops)"
+                ))
+        except Exception:
+            db.session.commit()
+            return False  # no permission to install the extension; ILIKE still works
+        db.session.commit()
+        return True
+    return False
+
+
+def has_fts():
+    """True if the SQLite FTS table exists (checked once per engine)."""
+    engine = db.engine
+    if engine.url not in _fts_available:
+        _fts_available[engine.url] = engine.dialect.name == "sqlite" and db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+        ).first() is not None
+    return _fts_available[engine.url]
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def material_filter(query):
+    if has_fts() and len(query) >= FTS_MIN_CHARS:
+        phrase = '"' + query.replace('"', '""') + '"'
+        return BudgetItem.id.in_(
+            db.select(text("rowid")).select_from(text(FTS_TABLE))
+            .where(text(f"{FTS_TABLE} MATCH :phrase").bindparams(phrase=phrase))
+        )
+    return BudgetItem.material_name.ilike(f"%{_escape_like(query)}%", escape="\\")
+
+
+def encode_item_cursor(value, item_id):
+    raw = json.dumps([value, item_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_item_cursor(raw, sort):
+    """(sort value, item id) from a cursor made for sort; the value must be a
+    scalar of the sort column's type."""
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(raw.encode()))
+        item_id = int(item_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    expected = SORT_COLUMNS[sort].type.python_type
+    if expected is float:
+        expected = (int, float)
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise ValueError("Invalid cursor")
+    return value, item_id
+
+
+def search_items(project_id, sku_prefix="", material="", shortfall=False, location=None,
+                 sort="sku", descending=False, limit=50, cursor=None):
+    """One page of a project's budget items matching the filters.
+
+    sku_prefix is case-sensitive so it can use the (project_id, sku) index.
+    Returns (items, next_cursor) where next_cursor is None on the last page.
+    Raises ValueError for an unknown sort or a bad cursor.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    sort_column = SORT_COLUMNS[sort]
+
+    stmt = db.select(BudgetItem).where(BudgetItem.project_id == project_id)
+    if sku_prefix:
+        # A range rather than LIKE, which SQLite can't serve from a case-sensitive index
+        stmt = stmt.where(BudgetItem.sku >= sku_prefix, BudgetItem.sku < sku_prefix + "\U0010ffff")
+    if material:
+        stmt = stmt.where(material_filter(material))
+    if shortfall:
+        stmt = stmt.where(BudgetItem.received < BudgetItem.quantity)
+    if location is not None:
+        # Empty matches items without a location; same expression as the index
+        stmt = stmt.where(SORT_COLUMNS["location"] == location)
+
+    if cursor is not None:
+        value, item_id = decode_item_cursor(cursor, sort)
+        after = (sort_column < value) if descending else (sort_column > value)
+        tie = (BudgetItem.id < item_id) if descending else (BudgetItem.id > item_id)
+        stmt = stmt.where(or_(after, and_(sort_column == value, tie)))
+
+    if descending:
+        stmt = stmt.order_by(sort_column.desc(), BudgetItem.id.desc())
+    else:
+        stmt = stmt.order_by(sort_column, BudgetItem.id)
+    rows = db.session.execute(stmt.add_columns(sort_column).limit(limit + 1)).all()
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last_item, last_value = page[-1]
+        next_cursor = encode_item_cursor(last_value, last_item.id)
+    return [item for item, _ in page], next_cursor
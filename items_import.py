@@ -0,0 +1,250 @@
+"""Bulk import of budget items from CSV, NDJSON or JSON.
+
+Rows are read as a stream and handled in chunks. Each chunk is validated
+column by column and the valid rows are upserted on the
+unique_sku_per_project constraint with the database's native
+INSERT ... ON CONFLICT. Invalid rows are reported with their row number and
+never abort the rest of the import.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import bindparam
+
+from models import db, BudgetItem, dialect_insert
+from rollups import add_change, apply as apply_rollups, touch
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+# Accepted spellings of each column, mapped to the BudgetItem attribute
+FIELD_ALIASES = {
+    "sku": "sku",
+    "materialname": "material_name",
+    "material_name": "material_name",
+    "material": "material_name",
+    "quantity": "quantity",
+    "received": "received",
+    "total_payed": "total_payed",
+    "totalpayed": "total_payed",
+}
+# Only overwritten on existing items when the row actually provides them,
+# so re-importing a takeoff doesn't wipe out what has been received
+OPTIONAL_FIELDS = ("received", "total_payed")
+
+
+class InvalidRow:
+    """A row that could not be read at all; reported as a row error."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_rows(stream, content_type="", filename=""):
+    """Yield raw row dicts from a binary stream, picking the format from the
+    content type or file extension."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    filename = (filename or "").lower()
+    if content_type in ("text/csv", "application/csv") or filename.endswith(".csv"):
+        yield from csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    elif content_type in ("application/x-ndjson", "application/jsonl") or filename.endswith((".ndjson", ".jsonl")):
+        for number, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8"), 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield InvalidRow(f"line {number}: invalid JSON ({e.msg})")
+    elif content_type == "application/json" or filename.endswith(".json"):
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError("JSON body must be a list of items")
+        yield from rows
+    else:
+        raise ValueError("Unsupported format; send CSV, NDJSON or a JSON list")
+
+
+def _normalize(row):
+    if not isinstance(row, dict):
+        return {}
+    out = {}
+    for key, value in row.items():
+        field = FIELD_ALIASES.get(str(key).strip().lower())
+        if field is not None and value not in (None, ""):
+            out[field] = value
+    return out
+
+
+def _to_int(value):
+    try:
+        number = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 0 else None
+
+
+def _to_money(value):
+    try:
+        return round(float(str(value).strip().lstrip("$")), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def validate_chunk(rows, first_row_number):
+    """Validate a chunk of raw rows column by column.
+
+    Returns (valid_rows, errors) where each error is {"row": n, "error": msg}
+    and n counts data rows from 1.
+    """
+    unreadable = {i: r.error for i, r in enumerate(rows) if isinstance(r, InvalidRow)}
+    rows = [_normalize(r) for r in rows]
+    skus = [str(r.get("sku", "")).strip() for r in rows]
+    materials = [str(r.get("material_name", "")).strip() for r in rows]
+    quantities = [_to_int(r.get("quantity")) for r in rows]
+    received = [_to_int(r["received"]) if "received" in r else 0 for r in rows]
+    paid = [_to_money(r["total_payed"]) if "total_payed" in r else 0.0 for r in rows]
+
+    valid, errors = [], []
+    for i, row in enumerate(rows):
+        if i in unreadable:
+            errors.append({"row": first_row_number + i, "error": unreadable[i]})
+            continue
+        problems = []
+        if not skus[i]:
+            problems.append("sku is required")
+        elif len(skus[i]) > 50:
+            problems.append("sku is longer than 50 characters")
+        if not materials[i]:
+            problems.append("materialName is required")
+        if quantities[i] is None:
+            problems.append("quantity must be a non-negative integer")
+        if received[i] is None:
+            problems.append("received must be a non-negative integer")
+        if paid[i] is None:
+            problems.append("total_payed must be a number")
+        if problems:
+            errors.append({"row": first_row_number + i, "error": "; ".join(problems)})
+            continue
+        valid.append({
+            "sku": skus[i],
+            "material_name": materials[i][:255],
+            "quantity": quantities[i],
+            "received": received[i],
+            "total_payed": paid[i],
+            "provided": tuple(f for f in OPTIONAL_FIELDS if f in row),
+        })
+    return valid, errors
+
+
+def upsert_items(project_id, rows):
+    """Insert or update rows (validated dicts) for project_id by SKU, and add
+    the changes to the project's rollups. Later rows win when a SKU repeats.
+    Does not commit.
+    """
+    # ON CONFLICT can't touch the same row twice in one statement
+    latest = {}
+    for row in rows:
+        latest[row["sku"]] = row
+    if not latest:
+        return 0
+
+    # Write first: with the project locked, the values read here are still
+    # the stored ones when the upsert replaces them
+    touch([project_id])
+    before = {
+        row.sku: (row.quantity, row.received, row.total_payed) for row in db.session.execute(
+            db.select(BudgetItem.sku, BudgetItem.quantity, BudgetItem.received, BudgetItem.total_payed)
+            .where(BudgetItem.project_id == project_id, BudgetItem.sku.in_(list(latest)))
+        )
+    }
+
+    groups = {}
+    for row in latest.values():
+        groups.setdefault(row["provided"], []).append({
+            "project_id": project_id,
+            "sku": row["sku"],
+            "material_name": row["material_name"],
+            "quantity": row["quantity"],
+            "received": row["received"],
+            "total_payed": row["total_payed"],
+            "extra_data": {},
+        })
+
+    insert = dialect_insert()
+    for provided, params in groups.items():
+        if insert is None:
+            _upsert_plain(params, provided, before)
+            continue
+        stmt = insert(BudgetItem.__table__)
+        update = {
+            "material_name": stmt.excluded.material_name,
+            "quantity": stmt.excluded.quantity,
+        }
+        for field in provided:
+            update[field] = getattr(stmt.excluded, field)
+        stmt = stmt.on_conflict_do_update(index_elements=["sku", "project_id"], set_=update)
+        db.session.execute(stmt, params)
+
+    deltas = {}
+    for sku, row in latest.items():
+        old = before.get(sku)
+        if old is None:
+            new = (row["quantity"], row["received"], row["total_payed"])
+        else:
+            new = (
+                row["quantity"],
+                row["received"] if "received" in row["provided"] else old[1],
+                row["total_payed"] if "total_payed" in row["provided"] else old[2],
+            )
+        add_change(deltas, project_id, old, new)
+    apply_rollups(deltas)
+    return len(latest)
+
+
+def _upsert_plain(params, provided, existing):
+    """Fallback for databases without INSERT ... ON CONFLICT; existing has
+    the SKUs already stored."""
+    table = BudgetItem.__table__
+    inserts = [p for p in params if p["sku"] not in existing]
+    if inserts:
+        db.session.execute(db.insert(table), inserts)
+    updates = [
+        dict({field: p[field] for field in ("material_name", "quantity") + provided},
+             b_project_id=p["project_id"], b_sku=p["sku"])
+        for p in params if p["sku"] in existing
+    ]
+    if updates:
+        db.session.execute(
+            db.update(table).where(table.c.project_id == bindparam("b_project_id"),
+                                   table.c.sku == bindparam("b_sku")),
+            updates,
+        )
+
+
+def import_items(project_id, rows, chunk_size=CHUNK_SIZE):
+    """Validate and upsert an iterable of raw rows in chunks, then commit.
+
+    Returns a summary with the number of rows read, rows upserted and the
+    row-level errors (the first MAX_REPORTED_ERRORS of them).
+    """
+    summary = {"rows": 0, "upserted": 0, "errorCount": 0, "errors": []}
+    chunk = []
+
+    def flush():
+        valid, errors = validate_chunk(chunk, summary["rows"] - len(chunk) + 1)
+        summary["upserted"] += upsert_items(project_id, valid)
+        summary["errorCount"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(summary["errors"])
+        summary["errors"].extend(errors[:max(room, 0)])
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        summary["rows"] += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    db.session.commit()
+    return summary
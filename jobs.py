@@ -0,0 +1,260 @@
+"""Database-backed background queue for PDF invoice ingestion.
+
+Uploads made with ``?async=1`` are stored as rows in the ``jobs`` table and
+picked up by a JobRunner: a few threads that claim queued rows, hand the
+CPU-bound pdfplumber parse to a process pool and then apply the result to the
+project from the thread, inside an app context.
+
+By default every web process starts a single-threaded runner
+(WEB_JOB_WORKERS) on its first request, so jobs left queued (or running on a
+worker that died) by a restart are picked up without waiting for another
+upload. For real throughput run a dedicated worker with JOB_WORKERS threads
+(one per core by default):
+
+    flask --app app run-jobs
+
+and set JOBS_EXTERNAL=1 so the web processes don't start runners at all.
+Claiming is a compare-and-set UPDATE, so any number of runners can share
+the table safely.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from models import db, Job, Project
+from archive import archive_pdf
+from parse_cache import pdf_digest
+from pdf import parse_pdf_timed, timed_result, parse_cache, apply_pdf_to_project
+
+log = logging.getLogger(__name__)
+
+APPLY_PDF = "apply-pdf"
+
+# Threads (and parse processes) of a dedicated run-jobs worker
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", os.cpu_count() or 2))
+# Threads of the runner each web process starts unless JOBS_EXTERNAL=1
+WEB_JOB_WORKERS = int(os.environ.get("WEB_JOB_WORKERS", 1))
+# Seconds a running job may go without an update before another runner retries it
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 600))
+JOB_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2.0
+JOBS_EXTERNAL = os.environ.get("JOBS_EXTERNAL") == "1"
+
+_runner = None
+_runner_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_pool():
+    """Process pool shared by everything that parses PDFs in this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent has live threads and DB connections
+            _pool = ProcessPoolExecutor(
+                max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def enqueue_pdf(app, project, data, filename=""):
+    """Queue raw PDF bytes to be parsed and applied to project. Returns the Job."""
+    job = Job(kind=APPLY_PDF, project_id=project.id, filename=filename, payload=data)
+    db.session.add(job)
+    db.session.commit()
+    if not JOBS_EXTERNAL:
+        get_runner(app).wake()
+    return job
+
+
+def parse_many(blobs):
+    """Parse several PDFs at once in the process pool, using the parse cache.
+
+    Returns one entry per blob, in order: the parse_pdf response, or the
+    exception raised while parsing it.
+    """
+    results = [None] * len(blobs)
+    futures = {}
+    for index, data in enumerate(blobs):
+        digest = pdf_digest(data)
+        archive_pdf(data, digest)
+        results[index] = parse_cache.get(digest)
+        if results[index] is None:
+            futures[index] = (digest, parse_pool().submit(parse_pdf_timed, data))
+    db.session.commit()  # don't hold a read transaction across the parse
+    for index, (digest, future) in futures.items():
+        try:
+            results[index] = timed_result(future)
+            parse_cache.put(digest, results[index])
+        except Exception as e:
+            results[index] = e
+    return results
+
+
+def get_runner(app, workers=WEB_JOB_WORKERS):
+    """The process-wide JobRunner, started with workers threads on first use."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(app, workers)
+            _runner.start()
+        return _runner
+
+
+def claim_next_job():
+    """Atomically move the oldest queued (or stale running) job to running.
+
+    Returns the claimed job id, or None if there is nothing to do.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    while True:
+        candidate = db.session.execute(
+            db.select(Job.id, Job.updated_at)
+            .where(
+                or_(
+                    Job.status == Job.QUEUED,
+                    and_(Job.status == Job.RUNNING, Job.updated_at < stale),
+                )
+            )
+            .order_by(Job.id)
+            .limit(1)
+        ).first()
+        if candidate is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            db.update(Job)
+            .where(Job.id == candidate.id, Job.updated_at == candidate.updated_at)
+            .values(
+                status=Job.RUNNING,
+                stage="parsing",
+                progress=10,
+                attempts=Job.attempts + 1,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return candidate.id
+        # Another runner got there first; look again
+
+
+class JobRunner:
+    """Claims jobs from the table and runs them with a shared process pool."""
+
+    def __init__(self, app, workers=JOB_WORKERS):
+        self.app = app
+        self.workers = max(1, workers)
+        self.pool = parse_pool()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"job-runner-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    job_id = claim_next_job()
+                    if job_id is not None:
+                        self.run_job(job_id)
+                except Exception:
+                    db.session.rollback()
+                    log.exception("Job runner loop failed")
+                    job_id = None
+                finally:
+                    db.session.remove()
+            if job_id is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+
+    def run_job(self, job_id):
+        job = db.session.get(Job, job_id)
+        if job.attempts > JOB_MAX_ATTEMPTS:
+            # Reclaimed too many times; whatever runs it keeps dying
+            self._fail(job, "Job abandoned after repeated worker failures")
+            return
+        try:
+            data = job.payload
+            digest = pdf_digest(data)
+            archive_pdf(data, digest)
+            response = parse_cache.get(digest)
+            db.session.commit()  # don't hold a read transaction across the parse
+            if response is None:
+                response = timed_result(self.pool.submit(parse_pdf_timed, data))
+                parse_cache.put(digest, response)
+
+            job.stage = "applying"
+            job.progress = 70
+            db.session.commit()
+
+            project = db.session.get(Project, job.project_id)
+            if project is None:
+                raise ValueError("Project no longer exists")
+            result = apply_pdf_to_project(project, response)
+
+            job.status = Job.DONE
+            job.stage = Job.DONE
+            job.progress = 100
+            job.result = result
+            job.error = result.get("error", "")
+            job.payload = None
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            log.warning("Job %s failed: %s", job_id, e)
+            self._fail(db.session.get(Job, job_id), str(e))
+
+    def _fail(self, job, error):
+        job.status = Job.FAILED
+        job.stage = Job.FAILED
+        job.error = error
+        job.payload = None
+        db.session.commit()
+
+
+def run_worker(app):
+    """Run a JobRunner in the foreground until interrupted."""
+    log.info("Running job worker with %d threads", JOB_WORKERS)
+    runner = get_runner(app, JOB_WORKERS)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+def init_app(app):
+    """Register the run-jobs command and, unless JOBS_EXTERNAL=1, start this
+    process's runner on the first request."""
+
+    @app.cli.command("run-jobs")
+    def run_jobs_command():
+        """Run queued background jobs in this process."""
+        run_worker(app)
+
+    if not JOBS_EXTERNAL:
+        @app.before_request
+        def _start_job_runner():
+            if _runner is None:
+                get_runner(app)
@@ -0,0 +1,58 @@
+"""Flask JSON provider backed by orjson.
+
+orjson serializes the large project and invoice payloads several times
+faster than the standard library. It is optional: without it, or with
+JSON_PROVIDER=stdlib, the app keeps Flask's default provider. Output
+matches the default provider's: keys are sorted, and dates still go through
+Flask's default() so they stay HTTP dates.
+"""
+import os
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "orjson")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumpb(self, obj):
+        """obj as UTF-8 JSON bytes."""
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent, separators etc. only exist in the stdlib encoder
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)  # pretty-printed for debugging
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj) + b"\n", mimetype=self.mimetype)
+
+
+def init_app(app):
+    if orjson is not None and JSON_PROVIDER != "stdlib":
+        app.json = OrjsonProvider(app)
+
+
+def dumpb(obj):
+    """obj serialized by the current app's provider, as bytes."""
+    provider = current_app.json
+    if isinstance(provider, OrjsonProvider):
+        return provider.dumpb(obj)
+    return provider.dumps(obj).encode()
@@ -0,0 +1,192 @@
+"""Scheduled mailbox polling.
+
+Set MAIL_POLL_INTERVAL to a number of seconds to have the app poll the
+invoice inbox by itself instead of waiting for someone to press the
+button. Each web process starts a MailPoller on its first request; the
+pollers compete for a lease in the leases table and only the holder talks
+to the mail server, so several gunicorn workers still poll once. Run
+``flask --app app poll-mail`` instead to poll from a dedicated process.
+
+The leader keeps one IMAP connection open between polls and records the
+highest UID it has handled in mailbox_state, so each poll only fetches
+newer messages. If the server's UIDVALIDITY changes the stored UID is
+meaningless and the next poll falls back to fetching unread mail.
+Attachments that fail are retried from mail_retries with backoff.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Lease, MailboxState
+from invoiceDownloader import (
+    open_mailbox, uid_validity, process_mailbox, retry_failed_attachments,
+)
+
+MAIL_POLL_INTERVAL = float(os.environ.get("MAIL_POLL_INTERVAL", 0))
+# How long the leader keeps the lease without renewing it; a poll must finish in this time
+MAIL_LEASE_SECONDS = int(os.environ.get("MAIL_LEASE_SECONDS", max(300, 3 * MAIL_POLL_INTERVAL)))
+
+LEASE_NAME = "mail-poller"
+MAILBOX = "INBOX"
+
+log = logging.getLogger(__name__)
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def acquire_lease(name, holder, seconds):
+    """Take or renew the named lease for holder. Returns True if holder has it."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+    taken = db.session.execute(
+        db.update(Lease)
+        .where(Lease.name == name, or_(Lease.holder == holder, Lease.expires_at < now))
+        .values(holder=holder, expires_at=expires_at)
+    )
+    db.session.commit()
+    if taken.rowcount == 1:
+        return True
+    if db.session.get(Lease, name) is not None:
+        db.session.commit()
+        return False
+    try:
+        db.session.add(Lease(name=name, holder=holder, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()  # another process created it first
+        return False
+
+
+def release_lease(name, holder):
+    db.session.execute(db.delete(Lease).where(Lease.name == name, Lease.holder == holder))
+    db.session.commit()
+
+
+class MailPoller:
+    """Polls the mailbox every interval seconds while holding the lease."""
+
+    def __init__(self, app, interval=MAIL_POLL_INTERVAL, connect=open_mailbox):
+        self.app = app
+        self.interval = interval
+        self.connect = connect
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.mail = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="mail-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.tick()
+                except Exception:
+                    db.session.rollback()
+                    log.exception("Mail poll failed")
+                    self.disconnect()  # start from a fresh connection next time
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.interval)
+        with self.app.app_context():
+            release_lease(LEASE_NAME, self.holder)
+        self.disconnect()
+
+    def tick(self):
+        """Poll once if this process holds the lease. Call inside an app context."""
+        if not acquire_lease(LEASE_NAME, self.holder, MAIL_LEASE_SECONDS):
+            self.disconnect()  # followers don't keep a connection open
+            return None
+        result = self.poll()
+        retry_failed_attachments()
+        return result
+
+    def poll(self):
+        if self.mail is None:
+            self.mail = self.connect()
+        validity = uid_validity(self.mail)
+
+        state = db.session.get(MailboxState, MAILBOX)
+        if state is None:
+            state = MailboxState(mailbox=MAILBOX, last_uid=0)
+            db.session.add(state)
+        if state.uidvalidity != validity:
+            if state.uidvalidity is not None:
+                log.warning("UIDVALIDITY of %s changed from %s to %s; rescanning unread mail",
+                            MAILBOX, state.uidvalidity, validity)
+            state.uidvalidity = validity
+            state.last_uid = 0
+        after_uid = state.last_uid or None
+        db.session.commit()
+
+        result = process_mailbox(self.mail, after_uid)
+        if result["last_uid"] > (after_uid or 0):
+            state = db.session.get(MailboxState, MAILBOX)
+            state.last_uid = result["last_uid"]
+            db.session.commit()
+        if result["found"]:
+            log.info("Mail poll: %d messages, %d invoices applied, %d queued for retry",
+                     result["found"], result["processed"], result["queued"])
+        return result
+
+    def disconnect(self):
+        if self.mail is None:
+            return
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+        self.mail = None
+
+
+def get_poller(app):
+    """The process-wide MailPoller, started on first use."""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = MailPoller(app)
+            _poller.start()
+        return _poller
+
+
+def init_app(app):
+    """Register the poll-mail command and, if MAIL_POLL_INTERVAL is set, start
+    polling in the background on the first request."""
+
+    @app.cli.command("poll-mail")
+    @click.option("--once", is_flag=True, help="Poll a single time and exit.")
+    def poll_mail_command(once):
+        """Poll the invoice mailbox (every MAIL_POLL_INTERVAL seconds, default 60)."""
+        poller = MailPoller(app, interval=MAIL_POLL_INTERVAL or 60)
+        if once:
+            result = poller.tick()
+            poller.disconnect()
+            click.echo("Another process holds the lease" if result is None
+                       else f"Applied {result['processed']} invoices from {result['found']} messages")
+            return
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            release_lease(LEASE_NAME, poller.holder)
+            poller.disconnect()
+
+    if MAIL_POLL_INTERVAL > 0:
+        @app.before_request
+        def _start_mail_poller():
+            if _poller is None:
+                get_poller(app)
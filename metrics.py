@@ -0,0 +1,159 @@
+"""In-process request metrics, exposed in Prometheus text format at /metrics.
+
+Records per-endpoint latency, SQL statement count and time per request
+(through SQLAlchemy cursor events) and pdfplumber time per page. Requests
+slower than SLOW_REQUEST_MS are logged to the "catalyst.slow" logger as one
+JSON object per line.
+
+Each process keeps its own numbers; with several gunicorn workers every
+scrape sees the worker that answered it.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+PAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+slow_log = logging.getLogger("catalyst.slow")
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(v[0]), v[1], v[2]) for k, v in sorted(self._series.items())]
+        for label_values, counts, total, count in snapshot:
+            labels = _labels(self.labels, label_values)
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le=bound)} {running}')
+            lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le="+Inf")} {count}')
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _labels(names, values, le=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by endpoint.",
+    labels=("endpoint", "method", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_sql_queries", "SQL statements issued per request.",
+    labels=("endpoint",), buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "http_request_sql_seconds", "Time spent in SQL per request.",
+    labels=("endpoint",),
+)
+PDF_PAGE_SECONDS = Histogram(
+    "pdf_page_parse_seconds", "pdfplumber text extraction time per page.",
+    buckets=PAGE_BUCKETS,
+)
+
+REGISTRY = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, PDF_PAGE_SECONDS)
+
+
+def observe_pdf_pages(page_seconds):
+    for seconds in page_seconds:
+        PDF_PAGE_SECONDS.observe(seconds)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is not None and has_request_context() and "metrics_start" in g:
+        g.metrics_queries += 1
+        g.metrics_sql_seconds += time.perf_counter() - start
+
+
+def init_app(app):
+    """Time every request and serve /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, endpoint, request.method, response.status_code)
+        REQUEST_QUERIES.observe(g.metrics_queries, endpoint)
+        REQUEST_SQL_SECONDS.observe(g.metrics_sql_seconds, endpoint)
+        if elapsed * 1000 >= SLOW_REQUEST_MS and slow_log.isEnabledFor(logging.WARNING):
+            slow_log.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "path": request.path,
+                "endpoint": endpoint,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 1),
+                "sql_queries": g.metrics_queries,
+                "sql_ms": round(g.metrics_sql_seconds * 1000, 1),
+            }))
+        return response
+
+    @app.route("/metrics")
+    def serve_metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
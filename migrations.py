@@ -0,0 +1,268 @@
+"""Versioned schema migrations.
+
+Run once per deploy, before any web or job workers start:
+
+    flask --app app migrate
+
+Each entry in MIGRATIONS runs at most once per database; the highest
+applied version is recorded in the schema_version table. Only one process
+migrates at a time: Postgres uses a session advisory lock, SQLite an
+exclusive lock on a file next to the database. A process that had to wait
+re-reads the version afterwards, so it finds the work already done.
+
+Version 1 creates any missing tables from the models, so a new database is
+fully built by it and later steps must be no-ops on that schema (check
+before altering, as add_missing_columns does).
+"""
+import contextlib
+import os
+from datetime import datetime
+
+import click
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import undefer
+
+from models import db, Project, BudgetItem, Invoice, promoted_fields
+from rollups import recompute_all
+from item_search import install_text_index
+
+# Arbitrary constant shared by every process migrating this database
+ADVISORY_LOCK_KEY = 7243100516
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(255), nullable=False, default=""),
+    db.Column("applied_at", db.DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+def create_tables():
+    """Create every table the models define that doesn't exist yet."""
+    db.create_all()
+
+
+def add_budget_item_sku():
+    add_missing_columns("budget_items", [("sku", "VARCHAR(50) NOT NULL DEFAULT ''")])
+
+
+def add_missing_columns(table, columns):
+    """ALTER TABLE ADD COLUMN for each (name, ddl) in columns the table lacks.
+
+    Returns the names of the columns that were added.
+    """
+    existing = {c["name"] for c in inspect(db.engine).get_columns(table)}
+    added = []
+    for name, ddl in columns:
+        if name not in existing:
+            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            added.append(name)
+    db.session.commit()
+    return added
+
+
+def add_project_rollups():
+    """Add the rollup columns to an existing projects table and fill them."""
+    added = add_missing_columns("projects", [
+        ("total_paid", "FLOAT NOT NULL DEFAULT 0"),
+        ("total_received", "INTEGER NOT NULL DEFAULT 0"),
+        ("budget_quantity", "INTEGER NOT NULL DEFAULT 0"),
+        ("budget_received", "INTEGER NOT NULL DEFAULT 0"),
+        ("over_budget_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("version", "INTEGER NOT NULL DEFAULT 1"),
+    ])
+    if added:
+        recompute_all()
+
+
+def create_index(name, table, columns):
+    # IF NOT EXISTS rather than reflection: expression indexes aren't reflected
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+    db.session.commit()
+
+
+def add_indexes():
+    """Create the lookup indexes the models declared when this shipped."""
+    # Listed rather than read from the models, which now also index columns
+    # that only exist from migration 7 on
+    create_index("ix_projects_created_at", "projects", "created_at")
+    create_index("ix_projects_name_lower", "projects", "lower(name)")
+    create_index("ix_budget_items_project_id", "budget_items", "project_id")
+
+
+def promote_item_fields(batch_size=1000):
+    """Copy location, um and price_per out of budget_items.extra_data into
+    their own columns, index them and build the material name search index."""
+    add_missing_columns("budget_items", [
+        ("location", "VARCHAR(64)"),
+        ("um", "VARCHAR(16)"),
+        ("price_per", "INTEGER"),
+    ])
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(BudgetItem.id, BudgetItem.extra_data)
+            .where(BudgetItem.id > last_id, BudgetItem.extra_data.isnot(None))
+            .order_by(BudgetItem.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            location, um, price_per = promoted_fields(row.extra_data)
+            if location or um or price_per is not None:
+                updates.append({"id": row.id, "location": location, "um": um, "price_per": price_per})
+        if updates:
+            db.session.execute(db.update(BudgetItem), updates)
+        db.session.commit()
+
+    # (project_id, sku) covers everything the project_id index did
+    db.session.execute(text("DROP INDEX IF EXISTS ix_budget_items_project_id"))
+    create_index("ix_budget_items_project_sku", "budget_items", "project_id, sku")
+    create_index("ix_budget_items_project_location", "budget_items", "project_id, location")
+    install_text_index()
+
+
+def add_sort_indexes():
+    """Index every item search sort key."""
+    # The location key index also serves the location filter
+    db.session.execute(text("DROP INDEX IF EXISTS ix_budget_items_project_location"))
+    create_index("ix_budget_items_project_location_key", "budget_items", "project_id, coalesce(location, '')")
+    create_index("ix_budget_items_project_um_key", "budget_items", "project_id, coalesce(um, '')")
+    create_index("ix_budget_items_project_price_key", "budget_items", "project_id, coalesce(price_per, -1)")
+
+
+def backfill_invoices():
+    """Copy invoices from the legacy projects.used_invoices JSON column into
+    the invoices/invoice_lines tables, then empty the JSON column.
+
+    Safe to run repeatedly: projects whose column is already empty are
+    skipped and invoice numbers already present for a project are not copied
+    twice.
+    """
+    projects = (
+        Project.query.options(undefer(Project.used_invoices))
+        .filter(Project.used_invoices.isnot(None))
+        .all()
+    )
+    moved = 0
+    for project in projects:
+        if not project.used_invoices:
+            continue
+        seen = {
+            number for (number,) in
+            db.session.query(Invoice.invoice_number).filter_by(project_id=project.id)
+        }
+        for response in project.used_invoices:
+            number = str(response.get("invoice_number", ""))
+            if number in seen:
+                continue
+            seen.add(number)
+            project.invoices.append(Invoice.from_response(response))
+            moved += 1
+        project.used_invoices = []
+    db.session.commit()
+    return moved
+
+
+MIGRATIONS = (
+    (1, "create tables", create_tables),
+    (2, "budget_items.sku", add_budget_item_sku),
+    (3, "project rollup columns", add_project_rollups),
+    (4, "lookup indexes", add_indexes),
+    (5, "move used_invoices into invoices table", backfill_invoices),
+    (6, "mail polling state, lease and retry tables", create_tables),
+    (7, "budget item location/um/price_per columns and search indexes", promote_item_fields),
+    (8, "budget item sort key indexes", add_sort_indexes),
+)
+
+
+def current_version():
+    schema_version.create(db.engine, checkfirst=True)
+    version = db.session.execute(db.select(db.func.max(schema_version.c.version))).scalar()
+    db.session.commit()
+    return version or 0
+
+
+@contextlib.contextmanager
+def migration_lock():
+    """Hold the database-wide migration lock for the duration of the block."""
+    engine = db.engine
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                conn.commit()
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        import fcntl
+        with open(os.path.abspath(engine.url.database) + ".migrate-lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+@contextlib.contextmanager
+def without_statement_timeout():
+    """Lift the Postgres statement_timeout (engine_config) in the block.
+
+    Index builds and backfills can outlast it, and the lock connection waits
+    in pg_advisory_lock for as long as another process is migrating. Every
+    connection checked out in the block gets statement_timeout = 0; the pool
+    is disposed afterwards so none of them is handed to a request.
+    """
+    engine = db.engine
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+
+    def lift(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET statement_timeout = 0")
+        cursor.close()
+        dbapi_connection.commit()
+
+    event.listen(engine, "checkout", lift)
+    try:
+        yield
+    finally:
+        event.remove(engine, "checkout", lift)
+        db.session.remove()
+        engine.dispose()
+
+
+def migrate(echo=None):
+    """Apply every pending migration in order. Returns the versions applied."""
+    applied = []
+    with without_statement_timeout(), migration_lock():
+        version = current_version()
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            if echo:
+                echo(f"Applying {number}: {description}")
+            step()
+            db.session.execute(schema_version.insert().values(version=number, description=description))
+            db.session.commit()
+            applied.append(number)
+    return applied
+
+
+def register_commands(app):
+    @app.cli.command("migrate")
+    def migrate_command():
+        """Bring the database schema up to date."""
+        applied = migrate(echo=click.echo)
+        if applied:
+            click.echo(f"Schema now at version {applied[-1]}")
+        else:
+            click.echo(f"Schema already at version {MIGRATIONS[-1][0]}")
@@ -1,48 +1,69 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
-from sqlalchemy import JSON
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy import JSON, func, text
 from sqlalchemy.ext.mutable import MutableList
 
 db = SQLAlchemy()
 
+
+def dialect_insert():
+    """The current database's insert() with ON CONFLICT support, or None if
+    it has none."""
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
 class Project(db.Model):
     __tablename__ = "projects"
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    used_invoices = db.Column(        
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Legacy storage for applied invoices, superseded by the invoices table.
+    # Kept only so migrations.backfill_invoices can copy old rows across.
+    used_invoices = deferred(db.Column(
         MutableList.as_mutable(JSON),
         nullable=False,
         default=list
-    )
+    ))
     total_cost = db.Column(db.Float, nullable=False, default = 0)
 
+    # Aggregates over budget_items, kept current by rollups.py
+    total_paid = db.Column(db.Float, nullable=False, default=0, server_default="0")
+    total_received = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    budget_quantity = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    budget_received = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    over_budget_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Bumped whenever the project, its items or its invoices change; used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
     budget_items = relationship(
         "BudgetItem", back_populates="project", cascade="all, delete-orphan"
     )
-    
-    def add_invoice(self, invoice):
-        """Add an invoice number to the used list if it's not already there."""
-        if self.used_invoices is None:
-            self.used_invoices = []
-        if invoice not in self.used_invoices:
-            self.used_invoices.append(invoice)
-        
-    def is_invoice_used(self, invoice_num):
-        """Check if an invoice number has already been used."""
-        if self.used_invoices is None:
-            return False
-        for inv in self.used_invoices:
-            
-            if inv["invoice_number"] == invoice_num:
-                return True
-        return False
-    
-    def get_used_invoice(self):
-        """Get the list of used invoice numbers."""
-        return self.used_invoices or []
+    invoices = relationship(
+        "Invoice", back_populates="project", cascade="all, delete-orphan",
+        order_by="Invoice.id",
+    )
+
+    # Name lookups are case-insensitive (create/update checks, emailed invoices)
+    __table_args__ = (db.Index("ix_projects_name_lower", func.lower(name)),)
+
+
+def promoted_fields(extra_data):
+    """(location, um, price_per) column values from a BudgetItem's extra_data."""
+    extra_data = extra_data or {}
+    location = str(extra_data.get("location") or "")[:64] or None
+    um = str(extra_data.get("um") or "")[:16] or None
+    price_per = str(extra_data.get("price_per") or "")
+    return location, um, int(price_per) if price_per.isdigit() else None
+
 
 class BudgetItem(db.Model):
     __tablename__ = "budget_items"
@@ -57,30 +78,262 @@ class BudgetItem(db.Model):
     received = db.Column(db.Integer, nullable=False, default=0)
     total_payed = db.Column(db.Float, nullable = False, default = 0)
     extra_data = db.Column(JSON, nullable=True, default=dict)
-    
-    # Ensure unique combination of sku and project_id
-    __table_args__ = (db.UniqueConstraint('sku', 'project_id', name='unique_sku_per_project'),)
+    # Copied out of extra_data so they can be filtered and sorted (item_search.py)
+    location = db.Column(db.String(64), nullable=True)
+    um = db.Column(db.String(16), nullable=True)
+    price_per = db.Column(db.Integer, nullable=True)  # digits as printed, decimal point dropped
+
+    # Ensure unique combination of sku and project_id. The constraint leads
+    # with sku, so per-project lookups need their own indexes; the first also
+    # serves SKU prefix searches within a project. The others are on the
+    # null-free sort keys of item_search.SORT_COLUMNS and must stay textually
+    # identical to them, or SQLite won't use them.
+    __table_args__ = (
+        db.UniqueConstraint('sku', 'project_id', name='unique_sku_per_project'),
+        db.Index("ix_budget_items_project_sku", "project_id", "sku"),
+        db.Index("ix_budget_items_project_location_key", "project_id", text("coalesce(location, '')")),
+        db.Index("ix_budget_items_project_um_key", "project_id", text("coalesce(um, '')")),
+        db.Index("ix_budget_items_project_price_key", "project_id", text("coalesce(price_per, -1)")),
+    )
 
     project = relationship("Project", back_populates="budget_items")
     
     def __init__(self, data):
-        self.sku = data['sku']
-        self.received = data['shipped']
-        self.material_name = data['description']
-        self.quantity = -1
-        self.total_payed = round(float(data['extension']), 2)  # Initialize total_payed to 0
-        self.extra_data = {
+        for field, value in self.values_from_line(data).items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def values_from_line(data):
+        """Column values for an item first seen on an invoice line (a parse_pdf item).
+
+        It has no budgeted quantity yet, so quantity is -1.
+        """
+        extra_data = {
             "ordered": data['ordered'],
             "um": data['unit_measurement'],
             "location": data['location'],
             "units": data['units'],
             "price_per": data['price_per'],
         }
-        
-    
-    def overwrite(self, sku, material, quantity_int, received_int, total_payed):
-        self.sku = sku
-        self.material_name = material
-        self.quantity = quantity_int
-        self.received = received_int
-        self.total_payed = total_payed
\ No newline at end of file
+        location, um, price_per = promoted_fields(extra_data)
+        return {
+            "sku": data['sku'],
+            "received": int(data['shipped'] or 0),
+            "material_name": data['description'],
+            "quantity": -1,
+            "total_payed": round(float(data['extension']), 2),
+            "extra_data": extra_data,
+            "location": location,
+            "um": um,
+            "price_per": price_per,
+        }
+
+
+class Invoice(db.Model):
+    __tablename__ = "invoices"
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False
+    )
+    invoice_number = db.Column(db.String(64), nullable=False)
+    total_price = db.Column(db.Float, nullable=False, default=0)
+    adress = db.Column(db.String(255), nullable=False, default="")
+    error = db.Column(db.Text, nullable=False, default="")
+    skipped_lines = db.Column(JSON, nullable=False, default=list)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # One row per invoice per project; doubles as the duplicate-check index
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'invoice_number', name='unique_invoice_per_project'),
+    )
+
+    project = relationship("Project", back_populates="invoices")
+    lines = relationship(
+        "InvoiceLine", back_populates="invoice", cascade="all, delete-orphan",
+        order_by="InvoiceLine.position",
+    )
+
+    @staticmethod
+    def values_from_response(response):
+        """Column values for the invoice row of a parse_pdf response."""
+        total = response.get("total_price") or 0
+        return {
+            "invoice_number": str(response["invoice_number"]),
+            "total_price": round(float(total), 2),
+            "adress": response.get("adress") or "",
+            "error": response.get("error") or "",
+            "skipped_lines": list(response.get("skipped_lines") or []),
+        }
+
+    @classmethod
+    def from_response(cls, response):
+        """Build an Invoice and its lines from a parse_pdf response."""
+        invoice = cls(**cls.values_from_response(response))
+        invoice.lines = [
+            InvoiceLine.from_item(position, item)
+            for position, item in enumerate(response.get("items") or [])
+        ]
+        return invoice
+
+    def to_dict(self, lines=None):
+        """Inverse of from_response, as served by GET /api/invoices/<id>.
+
+        lines may be given as rows selecting InvoiceLine.FIELDS, to avoid
+        loading self.lines.
+        """
+        if lines is None:
+            lines = self.lines
+        return {
+            "items": [{field: getattr(line, field) for field in InvoiceLine.FIELDS} for line in lines],
+            "skipped_lines": self.skipped_lines or [],
+            "invoice_number": self.invoice_number,
+            "invoice_used": False,
+            "total_price": f"{self.total_price:.2f}",
+            "error": self.error,
+            "adress": self.adress,
+        }
+
+
+class InvoiceLine(db.Model):
+    __tablename__ = "invoice_lines"
+
+    # Parsed values are kept as the strings the parser produced
+    FIELDS = (
+        "line", "shipped", "ordered", "unit_measurement", "sku",
+        "description", "location", "units", "price_per", "extension",
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(
+        db.Integer, db.ForeignKey("invoices.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    position = db.Column(db.Integer, nullable=False, default=0)
+    line = db.Column(db.String(16), nullable=False, default="")
+    shipped = db.Column(db.String(16), nullable=False, default="")
+    ordered = db.Column(db.String(16), nullable=False, default="")
+    unit_measurement = db.Column(db.String(16), nullable=False, default="")
+    sku = db.Column(db.String(50), nullable=False, default="")
+    description = db.Column(db.String(255), nullable=False, default="")
+    location = db.Column(db.String(64), nullable=False, default="")
+    units = db.Column(db.String(16), nullable=False, default="")
+    price_per = db.Column(db.String(32), nullable=False, default="")
+    extension = db.Column(db.String(32), nullable=False, default="")
+
+    invoice = relationship("Invoice", back_populates="lines")
+
+    @classmethod
+    def values_from_item(cls, position, item):
+        """Column values for one parse_pdf item (without invoice_id)."""
+        values = {field: str(item.get(field, "")) for field in cls.FIELDS}
+        values["position"] = position
+        return values
+
+    @classmethod
+    def from_item(cls, position, item):
+        return cls(**cls.values_from_item(position, item))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class Job(db.Model):
+    """A unit of background work, queued in the database (see jobs.py)."""
+    __tablename__ = "jobs"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    stage = db.Column(db.String(32), nullable=False, default=QUEUED)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=True
+    )
+    filename = db.Column(db.String(255), nullable=False, default="")
+    payload = deferred(db.Column(db.LargeBinary, nullable=True))
+    result = db.Column(JSON, nullable=True)
+    error = db.Column(db.Text, nullable=False, default="")
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "projectId": self.project_id,
+            "filename": self.filename,
+            "result": self.result,
+            "error": self.error,
+            "createdAt": self.created_at.isoformat(),
+            "updatedAt": self.updated_at.isoformat(),
+        }
+
+
+class ParsedPdf(db.Model):
+    """parse_pdf output cached by the SHA-256 of the PDF bytes (see parse_cache.py)."""
+    __tablename__ = "parsed_pdfs"
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    parser_version = db.Column(db.Integer, nullable=False)
+    result = db.Column(JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class MailboxState(db.Model):
+    """How far the mail poller has read a mailbox (see mail_poller.py).
+
+    UIDs are only comparable while the server's UIDVALIDITY stays the same.
+    """
+    __tablename__ = "mailbox_state"
+
+    mailbox = db.Column(db.String(255), primary_key=True)
+    uidvalidity = db.Column(db.BigInteger, nullable=True)
+    last_uid = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class Lease(db.Model):
+    """A named lock held by one process until it expires (see mail_poller.py)."""
+    __tablename__ = "leases"
+
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class MailRetry(db.Model):
+    """An emailed attachment that failed to parse or apply, retried with backoff."""
+    __tablename__ = "mail_retries"
+
+    PENDING = "pending"
+    DONE = "done"
+    DEAD = "dead"
+
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(32), nullable=False)
+    filename = db.Column(db.String(255), nullable=False, default="")
+    sha256 = db.Column(db.String(64), nullable=False)
+    payload = deferred(db.Column(db.LargeBinary, nullable=True))
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    error = db.Column(db.Text, nullable=False, default="")
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    __table_args__ = (db.Index("ix_mail_retries_due", "status", "next_attempt_at"),)
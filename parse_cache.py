@@ -0,0 +1,88 @@
+"""Cache of parse_pdf results keyed on the SHA-256 of the PDF bytes.
+
+Lookups go through a bounded in-process LRU first and then the parsed_pdfs
+table, so a PDF that was already parsed by any worker is never extracted
+again. Every entry records the parser version that produced it; entries from
+another version count as misses and are overwritten. The version may be a
+callable, read on every lookup, for versions that can change at runtime.
+"""
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ParsedPdf, dialect_insert
+
+PARSE_CACHE_SIZE = int(os.environ.get("PARSE_CACHE_SIZE", 256))
+
+
+def pdf_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ParseCache:
+    def __init__(self, version, size=PARSE_CACHE_SIZE):
+        self._version = version
+        self.size = size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version() if callable(self._version) else self._version
+
+    def get(self, digest):
+        """Cached response for digest, or None. Callers get their own copy."""
+        version = self.version
+        with self._lock:
+            entry = self._lru.get(digest)
+            if entry is not None and entry[0] == version:
+                self._lru.move_to_end(digest)
+                return copy.deepcopy(entry[1])
+
+        row = db.session.get(ParsedPdf, digest)
+        if row is None or row.parser_version != version:
+            return None
+        self._remember(digest, version, row.result)
+        return copy.deepcopy(row.result)
+
+    def put(self, digest, response):
+        """Remember a fresh parse_pdf response in memory and in the database."""
+        version = self.version
+        self._remember(digest, version, response)
+        insert = dialect_insert()
+        if insert is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.merge(
+                        ParsedPdf(sha256=digest, parser_version=version, result=copy.deepcopy(response))
+                    )
+            except IntegrityError:
+                pass  # another worker stored the same PDF first
+        else:
+            # A single statement: on SQLite a SELECT followed by an INSERT in one
+            # transaction fails with "database is locked" under concurrent writers
+            stmt = insert(ParsedPdf).values(
+                sha256=digest, parser_version=version, result=response, created_at=datetime.utcnow()
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["sha256"],
+                set_={"parser_version": stmt.excluded.parser_version, "result": stmt.excluded.result},
+            )
+            db.session.execute(stmt)
+        db.session.commit()
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def _remember(self, digest, version, response):
+        with self._lock:
+            self._lru[digest] = (version, copy.deepcopy(response))
+            self._lru.move_to_end(digest)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
@@ -0,0 +1,57 @@
+"""Bounded LRU of serialized response bodies.
+
+Keys include the project revision (its created_at and version, see
+api.project_revision), so an entry can never be served after the project
+changes; old revisions simply age out. Deleting a project discards its
+entries. The cache is
+bounded by the total size of the stored bodies, not by entry count.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+PAYLOAD_CACHE_BYTES = int(os.environ.get("PAYLOAD_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+class PayloadCache:
+    def __init__(self, max_bytes=PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(body, headers) stored for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers=None):
+        """Store body (bytes) and any extra response headers under key."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, headers or {})
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, match):
+        """Drop every entry whose key satisfies match(key)."""
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self.size -= len(self._entries.pop(key)[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+payload_cache = PayloadCache()
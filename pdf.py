@@ -1,32 +1,68 @@
-import re
-import pdfplumber
-from models import db, BudgetItem, Project
+import io
+import itertools
+import logging
 import os
+import re
+import time
+import zlib
 
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
+from models import db, dialect_insert, BudgetItem, Invoice, InvoiceLine, Project
+from rollups import add_change, apply as apply_rollups
+from archive import archive_pdf
+from metrics import observe_pdf_pages
+from invoice_layouts import NON_DIGITS, detect_layout, registry_signature
+from parse_cache import ParseCache, pdf_digest
 
-def apply_via_upload(file, project):
+log = logging.getLogger(__name__)
+
+# Bump whenever parse_pdf output changes so cached parses are redone. Layout
+# registry changes are picked up by parser_version() without a bump.
+PARSER_VERSION = 3
+
+
+def parser_version():
+    """PARSER_VERSION combined with the registered invoice layouts, as the
+    positive 32-bit integer parsed_pdfs.parser_version stores."""
+    return zlib.crc32(f"{PARSER_VERSION}|{registry_signature()}".encode()) & 0x7FFFFFFF
+
+
+parse_cache = ParseCache(parser_version)
+
+DUPLICATE_INVOICE_ERROR = "INVOICE HAS ALREADY BEEN USED IF ERROR EMAILL JAYKITT19@GMAIL.COM"
 
-    response = parse_pdf(file)
+
+def apply_via_upload(file, project):
+    response = parse_pdf_cached(file.read())
     return apply_pdf_to_project(project, response)
-    
-
-def apply_pdf_via_email(path):
-    # Read the file at 'path' and save it to a local file
-    with open(path, "rb") as src_file:
-        file_data = src_file.read()
-    filename = os.path.basename(path)
-    save_path = os.path.join(os.getcwd(), filename)
-    with open(save_path, "wb") as dest_file:
-        dest_file.write(file_data)
-    file = save_path
-    response = parse_pdf(file)
-    
+
+
+def parse_pdf_cached(data):
+    """parse_pdf for raw bytes, skipping extraction for PDFs seen before."""
+    digest = pdf_digest(data)
+    archive_pdf(data, digest)
+    response = parse_cache.get(digest)
+    if response is None:
+        response = parse_pdf(data)
+        parse_cache.put(digest, response)
+    return response
+
+
+def apply_pdf_via_email(source):
+    """Parse an emailed invoice (path, bytes or file object) and apply it."""
+    response = parse_pdf(source)
+    return apply_parsed_email(response)
+
+
+def apply_parsed_email(response):
+    """Apply a parsed emailed invoice to the project named after its ship-to address."""
     project = None
-    existing_project = Project.query.filter(Project.name == response['adress']).first()
+    existing_project = Project.query.filter(func.lower(Project.name) == response['adress'].lower()).first()
     if existing_project:
         project = existing_project
-        print(project)
+        log.debug("Applying emailed invoice to existing project %s", project.id)
     else:
 
         project = create_project(response)
@@ -39,117 +75,308 @@ def create_project(response):
 
     db.session.add(project)
     db.session.commit()
-    return project    
+    return project
 
-def parse_pdf(file):
-    # Parse the PDF file and extract its text content
-    text = ""
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-
-    parsing_items = False
-
-    invoiceNum = 0
-    
-    DaysOW = {"MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"}
-
-    response = {
-        "items": [],
-        "skipped_lines": [],
-        "invoice_number": 0,
-        "invoice_used": False,
-        "total_price": 0,
-        "error": "",
-        "adress": ""
-    }
-
-    expect_adress = False
-
-    for line in text.splitlines():
-        if parsing_items and line.upper().strip() in DaysOW:
-            parsing_items = False
-        elif "INVOICE:" in line:
-            response["invoice_number"] = re.sub(r'\D', '', line)
-            
-        elif "TOTAL" in line:
+
+TOTAL_PRICE = re.compile(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+\.\d{2})')
+# Lines read before choosing a layout when the text has no page breaks (parse_lines)
+FIRST_PAGE_LINES = 60
+
+# Only read the pages/regions that hold the item table (see page_lines)
+PDF_TABLE_ONLY = os.environ.get("PDF_TABLE_ONLY") == "1"
+
+
+class InvoiceParser:
+    """Line-at-a-time state machine that builds a parse_pdf response.
+
+    layout (an invoice_layouts.InvoiceLayout) must be set before the first
+    feed(); parse_pdf sets it from the first page.
+    """
+
+    def __init__(self, layout=None):
+        self.layout = layout
+        self.parsing_items = False
+        self.items_done = False
+        self.expect_adress = False
+        self.response = {
+            "items": [],
+            "skipped_lines": [],
+            "invoice_number": 0,
+            "invoice_used": False,
+            "total_price": 0,
+            "error": "",
+            "adress": "",
+            "layout": layout.name if layout is not None else "",
+        }
+
+    def set_layout(self, layout):
+        self.layout = layout
+        self.response["layout"] = layout.name
+
+    @property
+    def done(self):
+        """True once the item table has ended and the total has been read."""
+        return self.items_done and self.response["total_price"] not in (0, "")
+
+    def feed(self, line):
+        layout = self.layout
+        response = self.response
+        if self.parsing_items and layout.table_end.match(line.upper().strip()):
+            self.parsing_items = False
+            self.items_done = True
+        elif layout.invoice_marker in line:
+            response["invoice_number"] = NON_DIGITS.sub('', line)
+        elif layout.total_marker in line:
             # Extract the total price including the decimal point
-            match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+\.\d{2})', line.replace(',', ''))
-            if match:
-                response['total_price'] = match.group(1)
-            else:
-                response['total_price'] = ""
-        elif "SHIP TO:" in line: expect_adress = True
-        elif expect_adress:
-            split = line.split()
-            capture = False
-            for word in split:
-                if word == "DEL.":
-                    expect_adress=False
+            match = TOTAL_PRICE.search(line.replace(',', ''))
+            response['total_price'] = match.group(1) if match else ""
+        elif layout.ship_to_marker in line:
+            self.expect_adress = True
+        elif self.expect_adress:
+            capture = layout.address_after is None
+            for word in line.split():
+                if word == layout.address_until:
+                    self.expect_adress = False
                     break
                 if capture:
                     response["adress"] += word
-                if word == "LLC":
+                if word == layout.address_after:
                     capture = True
+            if layout.address_until is None:
+                self.expect_adress = False  # the address is the one line
 
-    
-        if parsing_items:
+        if self.parsing_items:
             split_line = line.split()
-            if len(split_line) < 14:
+            if len(split_line) < layout.min_columns:
                 response["skipped_lines"].append(split_line[0] if split_line else "")
                 response["error"] += ("Lines were skipped due to failure in pdf parsing please email the pdf to jaykit19@gmail.com \n")
-                continue  # skip lines that don't have enough columns
-            data = {
-                'line': re.sub(r'\D', '', split_line[0]),
-                'shipped': re.sub(r'\D', '', split_line[1]),
-                'ordered': re.sub(r'\D', '', split_line[2]),
-                'unit_measurement': split_line[3],
-                'sku': split_line[4],
-                'description': " ".join(split_line[5:9]),
-                'location': split_line[9] ,
-                'units': split_line[10],
-                'price_per': re.sub(r'\D', '', split_line[11]),
-                'extension': split_line[13]
-            }
-            
+                return  # skip lines that don't have enough columns
+            data = layout.build_item(split_line)
             response["items"].append(data)
-            if data['shipped'] != data['ordered']:
+            if layout.checks_ordered and data['shipped'] != data['ordered']:
                 response['error'] += ('LESS ITEMS SHIPPED THAN ORDERED PLEASE EMAIL JAYKITT19@GMAIL.COM \n')
 
-        if "EXTENSION" in line:
-            parsing_items = True
+        if layout.table_header in line:
+            self.parsing_items = True
+
+
+def parse_lines(lines, layout=None):
+    """Parse an iterable of invoice text lines into a parse_pdf response.
+
+    Without a layout, it is detected from the first FIRST_PAGE_LINES lines.
+    """
+    lines = iter(lines)
+    first_page = list(itertools.islice(lines, FIRST_PAGE_LINES))
+    parser = InvoiceParser(layout or detect_layout(first_page))
+    for line in itertools.chain(first_page, lines):
+        parser.feed(line)
+    return parser.response
+
+
+def page_lines(pdf, parser=None, table_only=False, page_times=None):
+    """Yield the text lines of pdf, as one list per page.
+
+    With table_only, pages after the first are cropped to start below their
+    item table header, which skips the repeated letterhead and column titles,
+    and reading stops as soon as parser reports the table and total have
+    been seen. The extraction time of each page read is appended to
+    page_times when given.
+    """
+    for number, page in enumerate(pdf.pages):
+        start = time.perf_counter()
+        region = page
+        if table_only and number > 0:
+            if parser is not None and parser.done:
+                break
+            header = [w for w in page.extract_words() if w["text"] == parser.layout.table_header]
+            if header:
+                region = page.within_bbox((0, header[0]["bottom"], page.width, page.height))
+        text = region.extract_text()
+        # Drop this page's layout objects before moving on to the next
+        page.flush_cache()
+        if page_times is not None:
+            page_times.append(time.perf_counter() - start)
+        yield text.splitlines()
+
+
+def parse_pdf(file, table_only=None, page_times=None):
+    """Parse an invoice from a path, raw bytes or a binary file object.
+
+    The supplier layout is picked from the first page's text (see
+    invoice_layouts) and used for the whole document. Per-page extraction
+    times go to page_times if given, otherwise straight into this process's
+    metrics.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        file = io.BytesIO(file)
+    if table_only is None:
+        table_only = PDF_TABLE_ONLY
+    # Imported here so processes that never parse (most web workers) don't load
+    # pdfminer and Pillow
+    import pdfplumber
+
+    record = page_times is None
+    if record:
+        page_times = []
+    parser = InvoiceParser()
+    with pdfplumber.open(file) as pdf:
+        for lines in page_lines(pdf, parser, table_only, page_times):
+            if parser.layout is None:
+                parser.set_layout(detect_layout(lines))
+            for line in lines:
+                parser.feed(line)
+    if record:
+        observe_pdf_pages(page_times)
+    return parser.response
+
+
+def parse_pdf_timed(data):
+    """parse_pdf for the process pool: returns (response, page_times) so the
+    parent can record the page timings in its own metrics."""
+    page_times = []
+    return parse_pdf(data, page_times=page_times), page_times
+
+
+def timed_result(future):
+    """Result of a pool-submitted parse_pdf_timed, recording its page times."""
+    response, page_times = future.result()
+    observe_pdf_pages(page_times)
     return response
 
+
 def apply_pdf_to_project(project, response):
-    # Refresh the project from database to get current budget_items
-    db.session.refresh(project)
-    
-    if project.is_invoice_used(response['invoice_number']):
+    apply_response(project, response)
+    db.session.commit()
+    return response
+
+
+def apply_response(project, response):
+    """Apply one parsed invoice to project without committing.
+
+    Every change is a single statement that adds to the stored values
+    (received = received + n), so invoices applied concurrently by other
+    workers are never overwritten. The invoice row goes in first with
+    ON CONFLICT DO NOTHING and is the duplicate guard: if the project already
+    has that invoice number nothing is changed and the response is marked
+    as used.
+    """
+    if not insert_invoice(project.id, response):
         response['invoice_used'] = True
-        response['error'] = "INVOICE HAS ALREADY BEEN USED IF ERROR EMAILL JAYKITT19@GMAIL.COM"
+        response['error'] = DUPLICATE_INVOICE_ERROR
         return response
 
-    for line in response['items']:
-        sku = line.get('sku')
-        quantity = int(line.get('shipped', 0))
-        total_payed = line.get('extension', '0')
-        
-        existing_item = None
-        for budget_item in project.budget_items:
-            if budget_item.sku == sku:
-                existing_item = budget_item
-                break
-        
-        if existing_item:
-            existing_item.received += quantity
-            
-            existing_item.total_payed += round(float(total_payed), 2)
+    db.session.execute(
+        db.update(Project)
+        .where(Project.id == project.id)
+        .values(total_cost=Project.total_cost + round(float(response['total_price']), 2))
+        .execution_options(synchronize_session=False)
+    )
+    apply_rollups(add_received(project.id, response['items']))
+
+    # The statements above bypassed the ORM; reload anything already loaded
+    db.session.expire(project, ["total_cost", "invoices", "budget_items"])
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, BudgetItem) and obj.project_id == project.id:
+            db.session.expire(obj, ["received", "total_payed"])
+    return response
+
+
+def insert_invoice(project_id, response):
+    """Insert the invoice and its lines unless project_id already has that
+    invoice number. Returns False for a duplicate."""
+    values = Invoice.values_from_response(response)
+    values["project_id"] = project_id
+    insert = dialect_insert()
+    if insert is not None:
+        invoice_id = db.session.execute(
+            insert(Invoice).values(**values)
+            .on_conflict_do_nothing(index_elements=["project_id", "invoice_number"])
+            .returning(Invoice.id)
+        ).scalar()
+        if invoice_id is None:
+            return False
+    else:
+        try:
+            with db.session.begin_nested():
+                invoice = Invoice(**values)
+                db.session.add(invoice)
+                db.session.flush()
+        except IntegrityError:
+            return False
+        invoice_id = invoice.id
+    lines = [
+        dict(InvoiceLine.values_from_item(position, item), invoice_id=invoice_id)
+        for position, item in enumerate(response.get('items') or [])
+    ]
+    if lines:
+        db.session.execute(db.insert(InvoiceLine), lines)
+    return True
+
+
+def add_received(project_id, lines):
+    """Add each line's shipped quantity and extension to its budget item,
+    creating items for SKUs the project doesn't have yet.
+
+    Returns the resulting rollup deltas (see rollups.add_change) for
+    rollups.apply; they hold an entry for project_id even without lines.
+    """
+    deltas = add_change({}, project_id)
+    rows = {}
+    for line in lines:
+        values = BudgetItem.values_from_line(line)
+        row = rows.get(values['sku'])
+        if row is None:
+            rows[values['sku']] = dict(values, project_id=project_id)
         else:
-            # Create new budget item=
-            new_item = BudgetItem(line)
-            new_item.project_id = project.id
-            project.budget_items.append(new_item)
-    project.add_invoice(response)
-    project.total_cost += round(float(response['total_price']), 2)
-    db.session.commit()
-    return response
\ No newline at end of file
+            # One row per SKU: an upsert can't touch the same row twice
+            row['received'] += values['received']
+            row['total_payed'] += values['total_payed']
+    if not rows:
+        return deltas
+    added = rows
+    # Sorted so concurrent writers lock items in the same order
+    rows = [rows[sku] for sku in sorted(rows)]
+
+    stored_columns = (BudgetItem.sku, BudgetItem.quantity, BudgetItem.received, BudgetItem.total_payed)
+    insert = dialect_insert()
+    if insert is not None:
+        stmt = insert(BudgetItem).values(rows)
+        stored = db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["sku", "project_id"],
+            set_={
+                "received": BudgetItem.received + stmt.excluded.received,
+                "total_payed": BudgetItem.total_payed + stmt.excluded.total_payed,
+            },
+        ).returning(*stored_columns)).all()
+    else:
+        _add_received_fallback(project_id, rows)
+        stored = db.session.execute(
+            db.select(*stored_columns)
+            .where(BudgetItem.project_id == project_id, BudgetItem.sku.in_(list(added)))
+        ).all()
+
+    # The rows are locked by the writes above, so the values before them are
+    # the stored ones less what was added; a new item was (-1, 0, 0) before,
+    # which adds nothing to any rollup
+    for sku, quantity, received, total_payed in stored:
+        line = added[sku]
+        add_change(
+            deltas, project_id,
+            (quantity, received - line['received'], total_payed - line['total_payed']),
+            (quantity, received, total_payed),
+        )
+    return deltas
+
+
+def _add_received_fallback(project_id, rows):
+    """add_received for databases without INSERT ... ON CONFLICT."""
+    for row in rows:
+        updated = db.session.execute(
+            db.update(BudgetItem)
+            .where(BudgetItem.project_id == project_id, BudgetItem.sku == row['sku'])
+            .values(received=BudgetItem.received + row['received'],
+                    total_payed=BudgetItem.total_payed + row['total_payed'])
+            .execution_options(synchronize_session=False)
+        )
+        if updated.rowcount == 0:
+            db.session.execute(db.insert(BudgetItem), [row])
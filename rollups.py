@@ -0,0 +1,206 @@
+"""Per-project aggregates over budget items, and the project version.
+
+The projects table carries total_paid, total_received, budget_quantity,
+budget_received and over_budget_count so that cross-project views never have
+to load items. They are maintained incrementally: every write adds what it
+changed to each column (total_received = total_received + :delta) in the
+UPDATE that also bumps projects.version, which the read endpoints build
+their ETags from. A write costs the same however many items the project
+has, and concurrent writers to one project never overwrite each other's
+totals.
+
+* ORM changes are picked up automatically by the session flush hooks below,
+  from the old and new values of every flushed BudgetItem.
+* Core statements that bypass the ORM (bulk upserts) must collect the old
+  and new values of the items they change with add_change() and pass the
+  result to apply() before committing; touch() only bumps the version.
+
+``flask recompute-rollups`` rebuilds every project from its items, to repair
+drift; migration 3 uses it to fill the columns in the first place.
+"""
+import click
+from sqlalchemy import bindparam, event, inspect, select, func, case, update
+from sqlalchemy.orm import Session
+
+from models import db, Project, BudgetItem, Invoice
+
+ROLLUP_FIELDS = ("total_paid", "total_received", "budget_quantity", "budget_received", "over_budget_count")
+
+_budgeted = BudgetItem.quantity >= 0
+
+
+def _aggregate(column):
+    return (
+        select(column)
+        .where(BudgetItem.project_id == Project.id)
+        .scalar_subquery()
+    )
+
+
+ROLLUP_VALUES = {
+    "total_paid": _aggregate(func.coalesce(func.sum(BudgetItem.total_payed), 0)),
+    "total_received": _aggregate(func.coalesce(func.sum(BudgetItem.received), 0)),
+    "budget_quantity": _aggregate(
+        func.coalesce(func.sum(case((_budgeted, BudgetItem.quantity), else_=0)), 0)
+    ),
+    "budget_received": _aggregate(
+        func.coalesce(func.sum(case((_budgeted, BudgetItem.received), else_=0)), 0)
+    ),
+    "over_budget_count": _aggregate(
+        func.count(case((_budgeted & (BudgetItem.received > BudgetItem.quantity), 1)))
+    ),
+}
+
+
+# What an item contributes to the rollups depends on these
+ITEM_FIELDS = ("quantity", "received", "total_payed")
+
+_projects = Project.__table__
+_APPLY_DELTAS = (
+    update(_projects)
+    .where(_projects.c.id == bindparam("pid"))
+    .values(
+        version=_projects.c.version + 1,
+        **{field: _projects.c[field] + bindparam(f"d_{field}") for field in ROLLUP_FIELDS},
+    )
+)
+
+
+def item_rollup(quantity, received, total_payed):
+    """One budget item's share of each ROLLUP_FIELDS column."""
+    received = received or 0
+    budgeted = quantity >= 0
+    return (
+        total_payed or 0,
+        received,
+        quantity if budgeted else 0,
+        received if budgeted else 0,
+        1 if budgeted and received > quantity else 0,
+    )
+
+
+def add_change(deltas, project_id, old=None, new=None):
+    """Add the rollup change of one item going from old to new to
+    deltas[project_id]. old and new are (quantity, received, total_payed),
+    or None where the item doesn't exist (before an insert, after a delete)."""
+    totals = deltas.setdefault(project_id, [0] * len(ROLLUP_FIELDS))
+    for sign, values in ((-1, old), (1, new)):
+        if values is not None:
+            for i, value in enumerate(item_rollup(*values)):
+                totals[i] += sign * value
+    return deltas
+
+
+def apply(deltas, connection=None):
+    """Add deltas ({project_id: one value per ROLLUP_FIELDS}) to the rollup
+    columns and bump each project's version, in one executemany UPDATE."""
+    params = []
+    for pid in sorted(pid for pid in deltas if pid is not None):  # a fixed lock order
+        values = {f"d_{field}": value for field, value in zip(ROLLUP_FIELDS, deltas[pid])}
+        values["d_total_paid"] = round(values["d_total_paid"], 2)
+        params.append(dict(values, pid=pid))
+    if not params:
+        return
+    if connection is None:
+        db.session.execute(_APPLY_DELTAS, params)
+        _expire(db.session, [p["pid"] for p in params])
+    else:
+        connection.execute(_APPLY_DELTAS, params)
+
+
+def touch(project_ids, connection=None):
+    """Bump the version of project_ids without changing their rollups. As
+    the first write of a transaction it also takes the projects' write lock."""
+    apply({pid: [0] * len(ROLLUP_FIELDS) for pid in project_ids}, connection)
+
+
+def recompute_all():
+    """Rebuild every project's rollups from its items. Returns the number of
+    projects. Only for repairs and migrations: it reads every item."""
+    result = db.session.execute(
+        update(Project)
+        .values(version=Project.version + 1, **ROLLUP_VALUES)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _expire(session, project_ids):
+    for pid in project_ids:
+        project = session.identity_map.get(session.identity_key(Project, pid))
+        if project is not None:
+            session.expire(project, ROLLUP_FIELDS + ("version",))
+
+
+def _values(obj, old):
+    """(project_id, (quantity, received, total_payed)) of a flushed item,
+    before the flush if old else after it."""
+    values = []
+    for key in ("project_id",) + ITEM_FIELDS:
+        history = inspect(obj).attrs[key].history
+        changed = history.deleted if old else history.added
+        current = changed or history.unchanged
+        values.append(current[0] if current else None)
+    return values[0], tuple(values[1:])
+
+
+def _flushed_deltas(session):
+    deltas = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Project):
+            if obj not in session.deleted and session.is_modified(obj, include_collections=False):
+                deltas.setdefault(obj.id, [0] * len(ROLLUP_FIELDS))
+        elif isinstance(obj, BudgetItem):
+            if obj not in session.new:
+                add_change(deltas, *_values(obj, old=True), None)
+            if obj not in session.deleted:
+                pid, new = _values(obj, old=False)
+                add_change(deltas, pid, None, new)
+        elif isinstance(obj, Invoice):
+            history = inspect(obj).attrs.project_id.history
+            for pid in history.sum():
+                deltas.setdefault(pid, [0] * len(ROLLUP_FIELDS))
+    return deltas
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+# Make assignments load the value they replace, so the flush hook knows it
+for _key in ("project_id",) + ITEM_FIELDS:
+    event.listen(getattr(BudgetItem, _key), "set", _load_old_value, active_history=True)
+
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    # Load expired values now: once the rows are written (or gone) the old
+    # values can't be told from the new ones
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BudgetItem):
+            for key in ("project_id",) + ITEM_FIELDS:
+                getattr(obj, key)
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    deltas = _flushed_deltas(session)
+    if deltas:
+        apply(deltas, session.connection())
+        session.info.setdefault("rollups_touched", set()).update(deltas)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _after_flush_postexec(session, flush_context):
+    ids = session.info.pop("rollups_touched", None)
+    if ids:
+        _expire(session, ids)
+
+
+def register_commands(app):
+    @app.cli.command("recompute-rollups")
+    def recompute_rollups_command():
+        """Recompute every project's budget rollups from its items."""
+        count = recompute_all()
+        click.echo(f"Recomputed rollups for {count} projects")
@@ -0,0 +1,76 @@
+"""JSON shapes of the API's resources.
+
+Each function takes an ORM object or a result row with the same attribute
+names, so endpoints that only need a few columns can select them directly
+instead of loading whole objects.
+"""
+from models import BudgetItem
+
+# Enough for budget_item_to_dict; select these to skip building BudgetItems
+BUDGET_ITEM_COLUMNS = (
+    BudgetItem.id,
+    BudgetItem.sku,
+    BudgetItem.material_name,
+    BudgetItem.quantity,
+    BudgetItem.received,
+    BudgetItem.total_payed,
+)
+
+
+def budget_item_to_dict(item):
+    return {
+        "id": item.id,
+        "sku": item.sku,
+        "materialName": item.material_name,
+        "quantity": item.quantity,
+        "received": item.received,
+        "total_payed": item.total_payed,
+    }
+
+
+def budget_item_detail_to_dict(item):
+    """budget_item_to_dict plus the promoted extra_data columns, as returned
+    by the item search."""
+    data = budget_item_to_dict(item)
+    data.update(location=item.location, um=item.um, pricePer=item.price_per)
+    return data
+
+
+def project_to_dict(project, items):
+    """A project with its budget items (ORM objects or BUDGET_ITEM_COLUMNS rows)."""
+    return {
+        "id": project.id,
+        "name": project.name,
+        "createdAt": project.created_at.isoformat(),
+        "budgetItems": [budget_item_to_dict(item) for item in items],
+    }
+
+
+def project_summary_to_dict(row):
+    """A row of the /projects?summary=1 aggregate query."""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "createdAt": row.created_at.isoformat(),
+        "total_cost": row.total_cost,
+        "itemCount": row.item_count,
+        "quantity": int(row.quantity),
+        "received": int(row.received),
+        "total_payed": round(float(row.total_payed), 2),
+    }
+
+
+def portfolio_to_dict(row):
+    """A project's precomputed rollups (see rollups.py)."""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "createdAt": row.created_at.isoformat(),
+        "total_cost": row.total_cost,
+        "totalPaid": round(row.total_paid, 2),
+        "totalReceived": row.total_received,
+        "budgetQuantity": row.budget_quantity,
+        "budgetReceived": row.budget_received,
+        "percentReceived": round(100.0 * row.budget_received / row.budget_quantity, 1) if row.budget_quantity else 0.0,
+        "overBudgetCount": row.over_budget_count,
+    }
@@ -1,18 +1,22 @@
-async function fetchProjects() {
+async function fetchProjects(cursor = null) {
     const projectsListEl = document.getElementById('projectsList');
 
-    projectsListEl.innerHTML = '<div class="badge">Loading...</div>';
+    const existingMore = document.getElementById('loadMoreProjects');
+    if (existingMore) existingMore.remove();
+    if (!cursor) projectsListEl.innerHTML = '<div class="badge">Loading...</div>';
 
     try {
-      const res = await fetch('/api/projects');
+      const url = cursor ? `/api/projects?cursor=${encodeURIComponent(cursor)}` : '/api/projects';
+      const res = await fetch(url);
       if (!res.ok) throw new Error('Failed to load projects');
       const projects = await res.json();
-      if (!Array.isArray(projects) || projects.length === 0) {
+      const nextCursor = res.headers.get('X-Next-Cursor');
+      if (!cursor && (!Array.isArray(projects) || projects.length === 0)) {
         projectsListEl.innerHTML = '<div class="empty">No projects yet. Create one on the left.</div>';
         return;
       }
       
-      projectsListEl.innerHTML = '';
+      if (!cursor) projectsListEl.innerHTML = '';
       for (const p of projects) {
         const item = document.createElement('div');
         item.className = 'project-item';
@@ -30,8 +34,17 @@ async function fetchProjects() {
         `;
         projectsListEl.appendChild(item);
       }
+      if (nextCursor) {
+        const more = document.createElement('button');
+        more.id = 'loadMoreProjects';
+        more.className = 'btn ghost small';
+        more.textContent = 'Load more';
+        more.addEventListener('click', () => fetchProjects(nextCursor));
+        projectsListEl.appendChild(more);
+      }
       // attach delete handlers
-      projectsListEl.querySelectorAll('button[data-delete]').forEach(btn => {
+      projectsListEl.querySelectorAll('button[data-delete]:not([data-bound])').forEach(btn => {
+        btn.setAttribute('data-bound', '1');
         btn.addEventListener('click', async (e) => {
           const id = e.currentTarget.getAttribute('data-delete');
           const confirmed = window.confirm('Delete this project? This cannot be undone.');
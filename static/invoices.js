@@ -6,15 +6,18 @@ function update_display(){
     document.getElementById('back_button').href = `projects/${projectId}`
 }
 
-async function generate_invoices_display(){
-    const res = await fetch(`/api/invoices/${projectId}`);
+async function generate_invoices_display(cursor = null){
+    const url = cursor ? `/api/invoices/${projectId}?cursor=${encodeURIComponent(cursor)}` : `/api/invoices/${projectId}`;
+    const res = await fetch(url);
     if(!res.ok) throw new Error('Failed to load invoices');
     const i = await res.json()
-    console.log(i)
-    invoice_holder = document.getElementById("invoice_holder").innerHTML
+    const nextCursor = res.headers.get('X-Next-Cursor');
+    const holder = document.getElementById("invoice_holder");
+    const existingMore = document.getElementById('loadMoreInvoices');
+    if (existingMore) existingMore.remove();
     let html = '';
     
-    if (i.length === 0) {
+    if (i.length === 0 && !cursor) {
         html = '<div class="no-invoices">No invoices found for this project.</div>';
     } else {
         for(const invoice of i){
@@ -59,7 +62,19 @@ async function generate_invoices_display(){
             `;
         }
     }
-    document.getElementById("invoice_holder").innerHTML = html;
+    if (cursor) {
+        holder.insertAdjacentHTML('beforeend', html);
+    } else {
+        holder.innerHTML = html;
+    }
+    if (nextCursor) {
+        const more = document.createElement('button');
+        more.id = 'loadMoreInvoices';
+        more.className = 'btn ghost small';
+        more.textContent = 'Load more';
+        more.addEventListener('click', () => generate_invoices_display(nextCursor));
+        holder.appendChild(more);
+    }
 }
 
 generate_invoices_display()
\ No newline at end of file
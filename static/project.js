@@ -174,9 +174,72 @@ async function saveProject(ev){
   }
 }
 
+async function applyManyPdfs(files, status){
+  const fd = new FormData();
+  for (const f of files) fd.append('files', f);
+  status.textContent = `Processing ${files.length} PDFs...`;
+  try {
+    const res = await fetch(`/api/projects/${projectId}/apply-pdfs`, { method: 'POST', body: fd });
+    const data = await res.json();
+    if (!res.ok) { throw new Error(data.error || 'Failed to apply PDFs'); }
+    const problems = data.results
+      .filter(r => r.status !== 'applied' || (r.skipped_lines && r.skipped_lines.length))
+      .map(r => `${r.filename}: ${r.status}${r.error ? ' - ' + r.error.trim() : ''}`);
+    status.textContent = `Applied ${data.applied}, duplicates ${data.duplicate}, failed ${data.error}` +
+      (problems.length ? '\n' + problems.join('\n') : '');
+    await loadProject();
+  } catch (err) {
+    status.textContent = err.message;
+  }
+}
+
+let searchCursor = null;
+
+async function searchItems(append){
+  // Filtering happens server-side; see GET /api/projects/<id>/items
+  const params = new URLSearchParams();
+  const sku = document.getElementById('searchSku').value.trim();
+  const text = document.getElementById('searchText').value.trim();
+  if (sku) params.set('sku', sku);
+  if (text) params.set('q', text);
+  if (document.getElementById('searchShortfall').checked) params.set('shortfall', '1');
+  if (append && searchCursor) params.set('cursor', searchCursor);
+  const results = document.getElementById('searchResults');
+  const more = document.getElementById('searchMore');
+  if (!append) results.innerHTML = '';
+  const res = await fetch(`/api/projects/${projectId}/items?${params}`);
+  const items = await res.json();
+  if (!res.ok) { results.textContent = items.error || 'Search failed'; return; }
+  for (const b of items) {
+    const row = document.createElement('div');
+    row.className = 'help';
+    row.textContent = `${b.sku}  ${b.materialName}  received ${b.received} of ${b.quantity}` +
+      (b.location ? `  @ ${b.location}` : '');
+    results.appendChild(row);
+  }
+  if (!append && items.length === 0) results.textContent = 'No matching items';
+  searchCursor = res.headers.get('X-Next-Cursor');
+  more.style.display = searchCursor ? '' : 'none';
+}
+
+async function waitForJob(jobId, status){
+  // Poll the background job until it finishes, then return its result
+  while (true) {
+    const res = await fetch(`/api/jobs/${jobId}`);
+    const job = await res.json();
+    if (!res.ok) throw new Error(job.error || 'Failed to check PDF status');
+    if (job.status === 'done') return job.result;
+    if (job.status === 'failed') throw new Error(job.error || 'Failed to apply PDF');
+    status.textContent = `Processing PDF (${job.stage}, ${job.progress}%)...`;
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+}
+
 window.addEventListener('DOMContentLoaded', () => {
   document.getElementById('form').addEventListener('submit', saveProject);
   document.getElementById('addRowBtn').addEventListener('click', ()=> addBudgetRow());
+  document.getElementById('searchForm').addEventListener('submit', (ev) => { ev.preventDefault(); searchItems(false); });
+  document.getElementById('searchMore').addEventListener('click', () => searchItems(true));
   const applyBtn = document.getElementById('applyPdfBtn');
   if (applyBtn) {
     applyBtn.addEventListener('click', async () => {
@@ -184,13 +247,18 @@ window.addEventListener('DOMContentLoaded', () => {
       const status = document.getElementById('pdfStatus');
       status.textContent = '';
       if (!fileInput.files || fileInput.files.length === 0) { status.textContent = 'Choose a PDF file first'; return; }
+      if (fileInput.files.length > 1) {
+        await applyManyPdfs(fileInput.files, status);
+        return;
+      }
       const fd = new FormData();
       fd.append('file', fileInput.files[0]);
       try {
-        const res = await fetch(`/api/projects/${projectId}/apply-pdf`, { method: 'POST', body: fd });
-        const data = await res.json();
-        let msg = ""
-        if (!res.ok) { throw new Error(data.error || 'Failed to apply PDF'); }
+        const res = await fetch(`/api/projects/${projectId}/apply-pdf?async=1`, { method: 'POST', body: fd });
+        const queued = await res.json();
+        if (!res.ok) { throw new Error(queued.error || 'Failed to apply PDF'); }
+        status.textContent = 'Processing PDF...';
+        const data = await waitForJob(queued.jobId, status);
         
         status.textContent = `Updated ${data.items ? data.items.length : 0} items`;
         if (data.error != "") {status.textContent = data.error}